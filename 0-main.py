@@ -1,16 +1,28 @@
 import csv
+import hashlib
 import os
+import queue
 import random
+import shutil
+import threading
 import time
 import json
+import multiprocessing
+import multiprocessing.util
 import re
+import zlib
 
-from bs4 import BeautifulSoup
+import lxml.html
+from lxml import etree
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from urllib.parse import quote
+from urllib.parse import quote, urljoin
+
+try:
+    import zstandard
+except ImportError:  # 未安装 zstandard 时归档退回 zlib 压缩
+    zstandard = None
 
 # ========== 全局配置部分 ==========
 
@@ -18,83 +30,296 @@ chrome_driver_path = ""
 user_data_dir = ""      
 max_notes = 500  # 每个关键词最多抓取的笔记数
 
+# 站点根地址；可改为本地 HTTP 服务地址（如 "http://127.0.0.1:8000"），用保存下来的笔记页面离线测试
+site_root = "https://www.xiaohongshu.com"
+
+# 详情页并发抓取的浏览器数量，1 表示沿用单个浏览器顺序抓取
+detail_workers = 1
+# 并发模式下，每个浏览器使用一份登录态副本，存放在该目录下
+worker_profile_root = "worker_profiles"
+
+# 运行模式："crawl" 在线爬取；"offline" 离线解析 offline_html_dir 下保存的详情页；
+# "rebuild" 从 html_archive_dir 中的归档重新抽取，生成 rebuild_output_file；
+# "batch" 无人值守批量模式：直接复用 user_data_dir 中已保存的登录状态，多个进程并发处理关键词
+run_mode = "crawl"
+# 批量模式同时运行的关键词进程数，以及各进程的中间结果目录
+batch_concurrency = 2
+batch_parts_dir = "batch_parts"
+# 详情页字段抽取方式："script" 一次 execute_script 取回全部字段；"html" 读取一次页面源码后用 lxml 解析
+extract_engine = "script"
+# 离线解析：保存的详情页目录（文件名为 <笔记ID>.html）、输出文件，以及用于回归对比的历史结果（可留空）
+offline_html_dir = "saved_pages"
+offline_output_file = "notes_offline.jsonl"
+offline_expected_file = ""
+
+# 详情页原始 HTML 归档目录（压缩、按内容去重），留空则不归档
+html_archive_dir = ""
+rebuild_output_file = "notes_rebuilt.jsonl"
+
 # 实时输出的 JSONL 文件：保存笔记链接 & 详细内容
 jsonl_output_file = "notes.jsonl"
 # CSV 输出目录
 output_dir = 'csv'
-os.makedirs(output_dir, exist_ok=True)
+
+# 访问节奏："adaptive" 令牌桶 + 根据页面耗时和异常自动调整；"fixed" 沿用原来的固定随机等待
+pacing = "adaptive"
+# 自适应节奏参数：初始 / 最小 / 最大请求速率（次/秒）与令牌桶容量
+pacing_rate = 0.5
+pacing_min_rate = 0.1
+pacing_max_rate = 2.0
+pacing_burst = 2
+
+# 断点续爬：已抓取笔记 ID 索引和各关键词进度检查点的存放目录，留空则不启用
+crawl_state_dir = "crawl_state"
 
 # 需要搜索的关键词列表
 keywords = ["tiktokrefugee"]  # 可添加更多关键词
 
-print("启动中，请等待...")
+POSTER_URL_PATTERN = re.compile(r'url\("(.*?)"\)')
+NOTE_ID_PATTERN = re.compile(r'/(?:search_result|explore)/(\w+)')
+
+CSV_HEADER = [
+    '笔记链接', '标题', '喜欢数', '收藏数', '评论数',
+    '时间', '笔记图片', '用户主页', '头像图片',
+    '用户昵称', '标签', '文本'
+]
+
+# ======== 浏览器启动 ========
+
+def create_driver(profile_dir, debug_port=9222):
+    """
+    按统一参数启动一个 Chrome 浏览器，profile_dir 为用户数据目录（保存登录状态）。
+    """
+    service = Service(chrome_driver_path)
+    options = Options()
+    options.add_argument(f"--remote-debugging-port={debug_port}")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    if profile_dir:
+        options.add_argument(f"--user-data-dir={profile_dir}")
+    options.add_argument("--disable-blink-features=AutomationControlled")  # 绕过反爬机制
+    return webdriver.Chrome(service=service, options=options)
+
+def clone_profile(src_dir, dst_dir):
+    """
+    复制已登录的用户数据目录。Chrome 不允许多个实例同时使用同一目录，
+    因此每个并发浏览器各用一份副本，复制时跳过单实例锁文件。
+    """
+    shutil.rmtree(dst_dir, ignore_errors=True)
+    shutil.copytree(
+        src_dir, dst_dir, symlinks=True,
+        ignore=shutil.ignore_patterns("Singleton*", "lockfile", "*.lock")
+    )
+
+def start_worker_drivers(n):
+    """
+    启动 n 个共享登录态（各自持有一份副本）的浏览器，用于并发抓取详情页。
+    """
+    drivers = []
+    for i in range(n):
+        profile_dir = ""
+        if user_data_dir:
+            profile_dir = os.path.join(worker_profile_root, f"worker{i}")
+            clone_profile(user_data_dir, profile_dir)
+        drivers.append(create_driver(profile_dir, debug_port=9223 + i))
+    print(f"已启动 {n} 个详情页抓取浏览器。")
+    return drivers
+
+# ========== 访问节奏控制 ==========
+
+class FixedPacer:
+    """
+    固定随机等待：搜索页 3~6 秒、每轮滚动 3~4 秒、详情页 1.5~3 秒。
+    同时统计等待时间与实际工作（页面加载）时间。
+    """
+
+    DELAYS = {"search": (3, 1, 3), "scroll": (2, 1, 2), "detail": (1, 0.5, 2)}
+    # 各类页面的最小等待（秒），给页面留出渲染/懒加载的时间
+    MIN_DELAYS = {"search": 1.0, "scroll": 1.0, "detail": 0.3}
 
-# ======== 启动浏览器 ========
-service = Service(chrome_driver_path)
-options = Options()
-options.add_argument("--remote-debugging-port=9222")
-options.add_argument("--disable-gpu")
-options.add_argument("--no-sandbox")
-options.add_argument("--disable-dev-shm-usage")
-options.add_argument(f"--user-data-dir={user_data_dir}")
-options.add_argument("--disable-blink-features=AutomationControlled")  # 绕过反爬机制
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wait_time = 0.0
+        self.work_time = 0.0
+        self.requests = 0
+        self.failures = 0
 
-driver = webdriver.Chrome(service=service, options=options)
-print("启动完成，请手动登录小红书...")
+    def _next_delay(self, kind):
+        base, low, high = self.DELAYS[kind]
+        return base + random.uniform(low, high)
 
-# 打开小红书主页，用户手动登录
-driver.get("https://www.xiaohongshu.com")
-input("请在打开的浏览器窗口中手动完成登录，登录完成后按回车键继续...")
+    def wait(self, kind):
+        """
+        在下一次访问（或读取页面）之前等待。
+        """
+        with self.lock:
+            delay = self._next_delay(kind)
+            self.wait_time += delay
+        time.sleep(delay)
 
-driver.refresh()
-print("已成功完成登录，开始爬取数据...\n")
+    def settle(self, kind):
+        """
+        页面加载完成后、读取页面之前的固定最小等待，给页面留出渲染时间；不占用令牌。
+        """
+        delay = self.MIN_DELAYS[kind]
+        with self.lock:
+            self.wait_time += delay
+        time.sleep(delay)
+
+    def observe(self, kind, latency, ok=True):
+        """
+        记录一次访问的耗时和结果；ok=False 表示出错或拿到空页面。
+        """
+        with self.lock:
+            self.requests += 1
+            self.work_time += latency
+            if not ok:
+                self.failures += 1
+            self._adjust(kind, latency, ok)
+
+    def _adjust(self, kind, latency, ok):
+        pass
+
+    def report(self):
+        total = self.wait_time + self.work_time
+        wait_share = self.wait_time / total if total > 0 else 0.0
+        return (f"访问 {self.requests} 次（异常/空页面 {self.failures} 次），"
+                f"等待 {self.wait_time:.1f} 秒，工作 {self.work_time:.1f} 秒，等待占比 {wait_share:.0%}")
+
+class AdaptivePacer(FixedPacer):
+    """
+    自适应节奏：
+    - 令牌桶限制整体请求速率（并发抓取时所有浏览器共用一个桶）；
+    - 每类页面的最小间隔随平均加载耗时（指数滑动平均）变化，网站变慢时自动放缓；
+    - 正常响应时速率缓慢上调，出错或拿到空页面时速率减半（加性增、乘性减）。
+    """
+
+    def __init__(self, rate=0.5, min_rate=0.1, max_rate=2.0, burst=2):
+        super().__init__()
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.tokens = burst
+        self.last_refill = time.monotonic()
+        self.latency = {}
+
+    def _next_delay(self, kind):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+        # 先预占一个令牌，令牌不足时等待其补足
+        self.tokens -= 1
+        bucket_delay = max(0.0, -self.tokens / self.rate)
+        # 随机抖动只作用于页面间隔，令牌桶的等待不能缩短，否则令牌尚未补足就发出请求
+        page_delay = (self.MIN_DELAYS[kind] + self.latency.get(kind, 0.0)) * random.uniform(0.8, 1.2)
+        return max(bucket_delay, page_delay)
+
+    def _adjust(self, kind, latency, ok):
+        previous = self.latency.get(kind)
+        self.latency[kind] = latency if previous is None else 0.8 * previous + 0.2 * latency
+        if ok:
+            self.rate = min(self.max_rate, self.rate + 0.05)
+        else:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def report(self):
+        return super().report() + f"，当前速率 {self.rate:.2f} 次/秒"
+
+def create_pacer(mode):
+    if mode == "fixed":
+        return FixedPacer()
+    return AdaptivePacer(rate=pacing_rate, min_rate=pacing_min_rate,
+                         max_rate=pacing_max_rate, burst=pacing_burst)
+
+pacer = create_pacer(pacing)
 
 # ========== 工具函数部分 ==========
 
-def scroll_and_get_links(driver, max_count=1000):
+# 只取上次调用之后新出现（或被虚拟列表复用后换了链接）的封面链接，同时返回页面高度并滚动到底部，
+# 每轮滚动只需一次 execute_script 往返
+HARVEST_SCRIPT = """
+const hrefs = [];
+for (const a of document.querySelectorAll('a.cover')) {
+    const href = a.getAttribute('href') || '';
+    if (a.dataset.harvested === href) continue;
+    a.dataset.harvested = href;
+    if (href) hrefs.push(href);
+}
+const height = document.body.scrollHeight;
+window.scrollTo(0, height);
+return [hrefs, height, document.querySelectorAll('a.cover').length];
+"""
+
+class LinkHarvester:
     """
-    滚动页面并动态获取笔记链接信息，直到获取到 max_count 条或无法继续加载更多。
+    增量收集搜索结果页中的笔记链接：
+    - 每轮只处理新加载的封面链接，不再重复解析整个页面；
+    - 用集合去重；
+    - new_counts 记录每轮滚动新增的链接数，便于判断信息流是否停滞。
     """
-    links = []
-    last_height = 0
 
-    while len(links) < max_count:
-        soup = BeautifulSoup(driver.page_source, "html.parser")
-        a_tags = soup.find_all('a', class_='cover')
+    def __init__(self, driver, max_count=1000):
+        self.driver = driver
+        self.max_count = max_count
+        self.links = []
+        self.seen = set()
+        self.new_counts = []
+        self.cover_count = 0
+
+    def harvest(self):
+        """
+        收集新增链接并滚动到底部，返回 (本轮新增链接数, 滚动前的页面高度)。
+        """
+        hrefs, height, self.cover_count = self.driver.execute_script(HARVEST_SCRIPT)
+        new_count = 0
+        for href in hrefs:
+            if len(self.links) >= self.max_count:
+                break
+            if "/explore/" in href or "/search_result/" in href:
+                full_url = f"{site_root}{href}"
+                if full_url not in self.seen:
+                    self.seen.add(full_url)
+                    self.links.append(full_url)
+                    new_count += 1
+        self.new_counts.append(new_count)
+        return new_count, height
 
-        for a in a_tags:
-            href = a.get('href', '')
-            if href and ("/explore/" in href or "/search_result/" in href):
-                full_url = f"https://www.xiaohongshu.com{href}"
-                if full_url not in links:
-                    links.append(full_url)
-                    if len(links) >= max_count:
-                        break
+    def is_full(self):
+        return len(self.links) >= self.max_count
 
-        driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-        time.sleep(2 + random.uniform(1, 2))
+def scroll_and_get_links(driver, max_count=1000, stall_rounds=3):
+    """
+    滚动页面并动态获取笔记链接信息，直到获取到 max_count 条或无法继续加载更多。
+    连续 stall_rounds 轮滚动没有新增链接时，视为信息流停滞，提前结束。
+    """
+    harvester = LinkHarvester(driver, max_count=max_count)
+    last_height = None
+    stalled = 0
 
-        new_height = driver.execute_script("return document.body.scrollHeight")
-        if new_height == last_height:
+    while not harvester.is_full():
+        start_time = time.time()
+        try:
+            new_count, height = harvester.harvest()
+        except Exception:
+            pacer.observe("scroll", time.time() - start_time, ok=False)
+            raise
+        # 本轮没有新链接多半只是到底或信息流停滞，不算异常；页面上一个笔记封面都没有（空页面、验证页）才算
+        pacer.observe("scroll", time.time() - start_time, ok=harvester.cover_count > 0)
+        if height == last_height:
             # 页面高度不变，说明到底或无法再加载更多
             break
-        last_height = new_height
+        last_height = height
 
-    return links
+        stalled = stalled + 1 if new_count == 0 else 0
+        if stalled >= stall_rounds:
+            print(f"连续 {stall_rounds} 轮滚动没有新链接，提前结束。")
+            break
 
-def safe_find_element(driver, by, selector):
-    """安全查找单个元素，若找不到则返回 None。"""
-    try:
-        return driver.find_element(by, selector)
-    except:
-        return None
+        pacer.wait("scroll")
 
-def safe_find_elements(driver, by, selector):
-    """安全查找多个元素，若找不到则返回空列表。"""
-    try:
-        return driver.find_elements(by, selector)
-    except:
-        return []
+    return harvester.links
 
 def extract_video_poster_url(style_str):
     """
@@ -102,15 +327,116 @@ def extract_video_poster_url(style_str):
     形如 background-image: url("http://xxx.jpg");
     用正则匹配双引号内的地址。
     """
-    pattern = r'url$begin:math:text$"(.*?)"$end:math:text$'
-    match = re.search(pattern, style_str)
+    match = POSTER_URL_PATTERN.search(style_str)
     if match:
         return match.group(1)
     return None
 
-def extract_note_details(driver, url):
+# ========== 笔记详情抽取引擎 ==========
+
+# 详情页各字段的定位表达式，在线脚本与离线解析共用同一份
+NOTE_XPATHS = {
+    "images": '//*[@id="noteContainer"]/div[2]/div/div/div[2]/div/div[contains(@class,"")]//img',
+    "poster": '//*[@id="noteContainer"]/div[2]/div/div/xg-poster',
+    "user_home": '//*[@id="noteContainer"]/div[4]/div[1]/div/div[1]/a[1]',
+    "avatar_image": '//*[@id="noteContainer"]/div[4]/div[1]/div/div[1]/a[1]/img',
+    "user_nickname": '//*[@id="noteContainer"]/div[4]/div[1]/div/div[1]/a[2]/span',
+    "title": '//*[@id="detail-title"]',
+    "desc": '//*[@id="detail-desc"]/span',
+    "time": '//span[contains(concat(" ", normalize-space(@class), " "), " date ")]',
+    "likes": '//*[@id="noteContainer"]/div[4]/div[3]/div/div/div[1]/div[2]/div/div[1]/span[1]/span[2]',
+    "favorites": '//*[@id="note-page-collect-board-guide"]/span',
+    "comments": '//*[@id="noteContainer"]/div[4]/div[3]/div/div/div[1]/div[2]/div/div[1]/span[3]/span',
+}
+
+# 离线解析用的预编译 XPath
+COMPILED_XPATHS = {name: etree.XPath(path) for name, path in NOTE_XPATHS.items()}
+
+# 在线抽取：一次 execute_script 取回全部字段的快照；元素不存在时对应字段为 null
+EXTRACT_SCRIPT = """
+const xp = __XPATHS__;
+const all = path => {
+    const r = document.evaluate(path, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    const nodes = [];
+    for (let i = 0; i < r.snapshotLength; i++) nodes.push(r.snapshotItem(i));
+    return nodes;
+};
+const first = path => all(path)[0] || null;
+const text = el => el ? (el.innerText || '').trim() : null;
+const strippedText = el => {
+    if (!el) return null;
+    const walker = document.createTreeWalker(el, NodeFilter.SHOW_TEXT);
+    let s = '';
+    while (walker.nextNode()) s += walker.currentNode.nodeValue.trim();
+    return s;
+};
+const poster = first(xp.poster);
+const userHome = first(xp.user_home);
+const avatar = first(xp.avatar_image);
+const desc = first(xp.desc);
+return {
+    images: all(xp.images).map(img => img.src),
+    poster_style: poster ? poster.getAttribute('style') : null,
+    user_home: userHome ? userHome.href : null,
+    avatar_image: avatar ? avatar.src : null,
+    user_nickname: text(first(xp.user_nickname)),
+    title: text(first(xp.title)),
+    text: text(desc),
+    tags: desc ? Array.from(desc.getElementsByTagName('a')).map(text) : [],
+    time: strippedText(first(xp.time)),
+    likes: text(first(xp.likes)),
+    favorites: text(first(xp.favorites)),
+    comments: text(first(xp.comments))
+};
+""".replace("__XPATHS__", json.dumps(NOTE_XPATHS))
+
+def _element_text(el):
     """
-    访问笔记详情页，抽取所需字段并返回字典形式的数据。
+    近似浏览器中 element.text 的结果：<br> 视为换行，首尾去空白。
+    """
+    for br in el.iter("br"):
+        br.tail = "\n" + (br.tail or "")
+    return el.text_content().strip()
+
+def snapshot_from_html(html, url):
+    """
+    用 lxml 一次性解析详情页 HTML，返回与 EXTRACT_SCRIPT 相同结构的字段快照。
+    链接类属性按页面地址 url 补全为绝对地址，与浏览器中读取到的结果一致。
+    """
+    doc = lxml.html.fromstring(html)
+
+    def first(name):
+        found = COMPILED_XPATHS[name](doc)
+        return found[0] if found else None
+
+    def attr(el, name):
+        value = el.get(name) if el is not None else None
+        return urljoin(url, value) if value else None
+
+    def text(el):
+        return _element_text(el) if el is not None else None
+
+    poster = first("poster")
+    desc = first("desc")
+    date = first("time")
+    return {
+        "images": [attr(img, "src") for img in COMPILED_XPATHS["images"](doc)],
+        "poster_style": poster.get("style") if poster is not None else None,
+        "user_home": attr(first("user_home"), "href"),
+        "avatar_image": attr(first("avatar_image"), "src"),
+        "user_nickname": text(first("user_nickname")),
+        "title": text(first("title")),
+        "text": text(desc),
+        "tags": [text(a) for a in desc.iter("a")] if desc is not None else [],
+        "time": "".join(t.strip() for t in date.itertext()) if date is not None else None,
+        "likes": text(first("likes")),
+        "favorites": text(first("favorites")),
+        "comments": text(first("comments")),
+    }
+
+def build_note_data(url, snap):
+    """
+    把字段快照整理成笔记数据字典。
     包括笔记图片、视频封面(若有)、用户主页、头像、昵称、标题、标签、文本、时间、点赞、收藏、评论。
     """
     data = {
@@ -128,187 +454,683 @@ def extract_note_details(driver, url):
         "comments": "0"
     }
 
-    driver.get(url)
-    time.sleep(1 + random.uniform(0.5, 2))
-
-    # ========== 图片处理 ========== 
-    img_urls = set()
-    # 1) 抓取所有图片
-    imgs = safe_find_elements(
-        driver,
-        By.XPATH,
-        '//*[@id="noteContainer"]/div[2]/div/div/div[2]/div/div[contains(@class,"")]//img'
-    )
-    for img_el in imgs:
-        src = img_el.get_attribute("src")
-        if src:
-            img_urls.add(src)
-
-    # 2) 不论是否有图片，都尝试抓取 xg-poster 里的封面图
-    poster_el = safe_find_element(
-        driver,
-        By.XPATH,
-        '//*[@id="noteContainer"]/div[2]/div/div/xg-poster'
-    )
-    if poster_el:
-        style_str = poster_el.get_attribute("style")
-        if style_str:
-            poster_url = extract_video_poster_url(style_str)
-            if poster_url:
-                img_urls.add(poster_url)
-
-    data["images"] = list(img_urls)
-
-    # ========== 用户主页、头像、昵称 ==========
-    user_home_el = safe_find_element(
-        driver,
-        By.XPATH,
-        '//*[@id="noteContainer"]/div[4]/div[1]/div/div[1]/a[1]'
-    )
-    if user_home_el:
-        home_href = user_home_el.get_attribute("href")
-        if home_href:
-            data["user_home"] = home_href
-
-    avatar_img_el = safe_find_element(
-        driver,
-        By.XPATH,
-        '//*[@id="noteContainer"]/div[4]/div[1]/div/div[1]/a[1]/img'
-    )
-    if avatar_img_el:
-        avatar_src = avatar_img_el.get_attribute("src")
-        if avatar_src:
-            data["avatar_image"] = avatar_src
-
-    nickname_el = safe_find_element(
-        driver,
-        By.XPATH,
-        '//*[@id="noteContainer"]/div[4]/div[1]/div/div[1]/a[2]/span'
-    )
-    if nickname_el:
-        data["user_nickname"] = nickname_el.text.strip()
+    # ========== 图片处理 ==========
+    # 不论是否有图片，都尝试加入 xg-poster 里的封面图；去重并保持页面顺序
+    img_urls = [src for src in snap["images"] if src]
+    if snap["poster_style"]:
+        poster_url = extract_video_poster_url(snap["poster_style"])
+        if poster_url:
+            img_urls.append(poster_url)
+    data["images"] = list(dict.fromkeys(img_urls))
 
-    # ========== 标题 ==========
-    title_el = safe_find_element(driver, By.XPATH, '//*[@id="detail-title"]')
-    if title_el:
-        data["title"] = title_el.text.strip()
+    # ========== 用户主页、头像 ==========
+    if snap["user_home"]:
+        data["user_home"] = snap["user_home"]
+    if snap["avatar_image"]:
+        data["avatar_image"] = snap["avatar_image"]
 
     # ========== 标签 & 文本（描述） ==========
-    desc_el = safe_find_element(driver, By.XPATH, '//*[@id="detail-desc"]/span')
-    if desc_el:
-        full_text = desc_el.text.strip()
-        # 提取标签
-        tag_elements = desc_el.find_elements(By.TAG_NAME, "a")
-        tag_list = []
-        for t in tag_elements:
-            tag_txt = t.text.strip()
-            if tag_txt.startswith("#"):
-                tag_list.append(tag_txt)
-        data["tags"] = tag_list
-        data["text"] = full_text
-
-    # ========== 时间 ==========
-    soup = BeautifulSoup(driver.page_source, "html.parser")
-    date_span = soup.find('span', class_="date")
-    if date_span:
-        data["time"] = date_span.get_text(strip=True)
-
-    # ========== 点赞、收藏、评论 ==========
-    likes_el = safe_find_element(
-        driver,
-        By.XPATH,
-        '//*[@id="noteContainer"]/div[4]/div[3]/div/div/div[1]/div[2]/div/div[1]/span[1]/span[2]'
-    )
-    if likes_el:
-        data["likes"] = likes_el.text.strip()
+    if snap["text"] is not None:
+        data["text"] = snap["text"]
+        data["tags"] = [t for t in snap["tags"] if t and t.startswith("#")]
 
-    fav_el = safe_find_element(
-        driver,
-        By.XPATH,
-        '//*[@id="note-page-collect-board-guide"]/span'
-    )
-    if fav_el:
-        data["favorites"] = fav_el.text.strip()
-
-    comment_el = safe_find_element(
-        driver,
-        By.XPATH,
-        '//*[@id="noteContainer"]/div[4]/div[3]/div/div/div[1]/div[2]/div/div[1]/span[3]/span'
-    )
-    if comment_el:
-        data["comments"] = comment_el.text.strip()
+    # ========== 昵称、标题、时间、点赞、收藏、评论 ==========
+    for key in ("user_nickname", "title", "time", "likes", "favorites", "comments"):
+        if snap[key] is not None:
+            data[key] = snap[key]
 
     return data
 
-# ========== 主流程 ==========
+def extract_note_from_html(html, url):
+    """
+    从保存下来的详情页 HTML 中抽取笔记数据，与在线抓取走同一套字段整理逻辑。
+    """
+    return build_note_data(url, snapshot_from_html(html, url))
+
+def extract_note_details(driver, url):
+    """
+    访问笔记详情页，抽取所需字段并返回字典形式的数据。
+    """
+    return fetch_note(driver, url)[0]
+
+def fetch_note(driver, url, keep_html=False):
+    """
+    访问笔记详情页，返回 (笔记数据, 页面 HTML)。
+    extract_engine 为 "script" 时用一次 execute_script 取回全部字段；
+    为 "html" 时只读取一次 page_source，交给 lxml 解析。
+    keep_html 为 False 时不额外读取页面源码，HTML 返回 None。
+    """
+    # 先取令牌再发出请求，并发抓取时所有浏览器的请求都受同一个令牌桶限制
+    pacer.wait("detail")
+    start_time = time.time()
+    try:
+        driver.get(url)
+    except Exception:
+        pacer.observe("detail", time.time() - start_time, ok=False)
+        raise
+    latency = time.time() - start_time
+    pacer.settle("detail")
+
+    html = None
+    if extract_engine == "html":
+        html = driver.page_source
+        data = extract_note_from_html(html, url)
+    else:
+        data = build_note_data(url, driver.execute_script(EXTRACT_SCRIPT))
+        if keep_html:
+            html = driver.page_source
+    # 标题、正文、时间都为空，多半是页面没加载出来或触发了验证
+    pacer.observe("detail", latency, ok=bool(data["title"] or data["text"] or data["time"]))
+    return data, html
+
+def extract_offline(html_dir, output_file, expected_file=""):
+    """
+    离线解析 html_dir 下保存的详情页（文件名为笔记 ID，如 <id>.html），写出 JSONL 并统计解析速度。
+    若提供 expected_file（如历史 notes.jsonl），按笔记 ID 对比各字段，输出不一致的数量，用于回归测试。
+    """
+    file_names = sorted(f for f in os.listdir(html_dir) if f.endswith(".html"))
+    start_time = time.time()
+    notes = []
+    for file_name in file_names:
+        note_id = os.path.splitext(file_name)[0]
+        with open(os.path.join(html_dir, file_name), "r", encoding="utf-8") as f:
+            html = f.read()
+        notes.append(extract_note_from_html(html, f"{site_root}/search_result/{note_id}"))
+    elapsed = time.time() - start_time
+
+    with open(output_file, "w", encoding="utf-8") as f:
+        for note in notes:
+            f.write(json.dumps(note, ensure_ascii=False) + "\n")
+    pages_per_sec = len(notes) / elapsed if elapsed > 0 else 0.0
+    print(f"离线解析 {len(notes)} 个页面，耗时 {elapsed:.2f} 秒，速度 {pages_per_sec:.1f} 页/秒，"
+          f"结果已保存到 {output_file}。")
+
+    if expected_file:
+        expected = {}
+        with open(expected_file, "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                expected[extract_note_id(record["note_url"])] = record
+        mismatches = {}
+        compared = 0
+        for note in notes:
+            old = expected.get(extract_note_id(note["note_url"]))
+            if old is None:
+                continue
+            compared += 1
+            for key, value in note.items():
+                if key != "note_url" and old.get(key) != value:
+                    mismatches[key] = mismatches.get(key, 0) + 1
+        print(f"与 {expected_file} 对比了 {compared} 条笔记，字段不一致数量：{mismatches or '无'}")
+
+def extract_note_id(note_url):
+    """
+    从笔记链接中取出笔记 ID（/search_result/<id> 或 /explore/<id>）。
+    """
+    match = NOTE_ID_PATTERN.search(note_url)
+    return match.group(1) if match else None
+
+# ========== 详情页抓取：顺序 / 并发 ==========
+
+def crawl_details_serial(driver, urls, keep_html=False):
+    """
+    用单个浏览器依次抓取详情页，逐条产出 (笔记数据, 页面 HTML)。
+    抓取失败的页面会打印错误并跳过。
+    """
+    for url in urls:
+        try:
+            result = fetch_note(driver, url, keep_html)
+        except Exception as e:
+            print(f"笔记详情抓取失败：{url}，错误：{e}")
+            continue
+        yield result
+
+def crawl_details_pool(drivers, urls, keep_html=False):
+    """
+    多浏览器并发抓取详情页：每个浏览器对应一个线程，从共享队列中领取链接；
+    结果先按序号缓存，再按原始链接顺序逐条产出 (笔记数据, 页面 HTML)，保证写出顺序与单浏览器模式一致。
+    抓取失败的页面会打印错误并跳过。
+    """
+    task_queue = queue.Queue()
+    for item in enumerate(urls):
+        task_queue.put(item)
+    result_queue = queue.Queue()
+
+    def worker(worker_driver):
+        while True:
+            try:
+                idx, url = task_queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                result = fetch_note(worker_driver, url, keep_html)
+            except Exception as e:
+                print(f"笔记详情抓取失败：{url}，错误：{e}")
+                result = None
+            result_queue.put((idx, result))
+
+    threads = [threading.Thread(target=worker, args=(d,), daemon=True) for d in drivers]
+    for t in threads:
+        t.start()
+
+    pending = {}
+    next_idx = 0
+    for _ in range(len(urls)):
+        idx, result = result_queue.get()
+        pending[idx] = result
+        while next_idx in pending:
+            result = pending.pop(next_idx)
+            next_idx += 1
+            if result is not None:
+                yield result
+
+    for t in threads:
+        t.join()
+
+def write_note(writer, jsonl_file, keyword, note_data):
+    """
+    把一条笔记详情写入 CSV，并实时追加到 JSONL。
+    """
+    # 写入 CSV（可根据需要保留或去除）
+    writer.writerow([
+        note_data["note_url"],
+        note_data["title"],
+        note_data["likes"],
+        note_data["favorites"],
+        note_data["comments"],
+        note_data["time"],
+        "|".join(note_data["images"]),
+        note_data["user_home"],
+        note_data["avatar_image"],
+        note_data["user_nickname"],
+        "|".join(note_data["tags"]),
+        note_data["text"]
+    ])
+
+    # 实时写入 JSONL
+    record = {"keyword": keyword, **note_data}
+    jsonl_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+    jsonl_file.flush()
+
+# ========== 断点续爬：笔记 ID 索引与关键词检查点 ==========
+
+class CrawlIndex:
+    """
+    持久化的抓取索引：
+    - note_ids.txt 逐行追加已抓取的笔记 ID，启动时加载为集合，已抓取的笔记直接跳过；
+      首次启用时从已有的 notes.jsonl 中导入 ID；
+    - checkpoints/<关键词>.json 保存该关键词收集到的链接及是否完成，
+      中断后重跑时直接沿用链接列表，从停下的位置继续。
+    """
+
+    def __init__(self, state_dir, bootstrap_file=""):
+        self.checkpoint_dir = os.path.join(state_dir, "checkpoints")
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        self.ids_file = os.path.join(state_dir, "note_ids.txt")
+        self.ids = set()
+
+        if os.path.exists(self.ids_file):
+            with open(self.ids_file, "r", encoding="utf-8") as f:
+                self.ids.update(line.strip() for line in f if line.strip())
+        elif bootstrap_file and os.path.exists(bootstrap_file):
+            with open(bootstrap_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    note_id = extract_note_id(json.loads(line).get("note_url", ""))
+                    if note_id:
+                        self.ids.add(note_id)
+            with open(self.ids_file, "w", encoding="utf-8") as f:
+                f.writelines(f"{note_id}\n" for note_id in self.ids)
+            print(f"已从 {bootstrap_file} 导入 {len(self.ids)} 个已抓取笔记 ID。")
+
+        self._ids_fp = open(self.ids_file, "a", encoding="utf-8")
+
+    def __contains__(self, note_id):
+        return note_id in self.ids
+
+    def add(self, note_id):
+        if note_id and note_id not in self.ids:
+            self.ids.add(note_id)
+            self._ids_fp.write(note_id + "\n")
+            self._ids_fp.flush()
+
+    def _checkpoint_path(self, keyword):
+        return os.path.join(self.checkpoint_dir, f"{quote(keyword, safe='')}.json")
+
+    def load_checkpoint(self, keyword):
+        path = self._checkpoint_path(keyword)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_checkpoint(self, keyword, links, done=False):
+        path = self._checkpoint_path(keyword)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"keyword": keyword, "links": links, "done": done}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def close(self):
+        self._ids_fp.close()
+
+# ========== 原始 HTML 归档 ==========
+
+class HtmlArchive:
+    """
+    详情页原始 HTML 的压缩归档，便于选择器失效或新增字段时不必重新爬取：
+    - segments/seg-XXXXX.bin：逐页独立压缩（优先 zstd）后顺序追加，超过 segment_size 字节换新段；
+    - index.jsonl：每页一行，记录笔记 ID、链接、关键词、内容哈希、归档时间及其所在段、偏移和长度；
+    - 以 HTML 的 sha256 去重：内容相同的页面只存一份，索引指向同一位置。
+    """
+
+    def __init__(self, archive_dir, segment_size=256 * 1024 * 1024):
+        self.segment_dir = os.path.join(archive_dir, "segments")
+        os.makedirs(self.segment_dir, exist_ok=True)
+        self.index_file = os.path.join(archive_dir, "index.jsonl")
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+        self.locations = {}
+        self.entries = set()
+        self.segment_no = 0
+
+        if os.path.exists(self.index_file):
+            for entry in self.read_index(self.index_file):
+                self.locations[entry["sha256"]] = entry
+                self.entries.add((entry["note_id"], entry["sha256"]))
+                self.segment_no = max(self.segment_no, entry["segment"])
+
+        self.codec = "zstd" if zstandard else "zlib"
+        self._compressor = zstandard.ZstdCompressor(level=10) if zstandard else None
+        self._index_fp = open(self.index_file, "a", encoding="utf-8")
+        self._segment_fp = open(self._segment_path(self.segment_no), "ab")
+
+    @staticmethod
+    def read_index(index_file):
+        with open(index_file, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def _segment_path(self, segment_no):
+        return os.path.join(self.segment_dir, f"seg-{segment_no:05d}.bin")
+
+    def _compress(self, raw):
+        if self._compressor:
+            return self._compressor.compress(raw)
+        return zlib.compress(raw, 9)
+
+    def put(self, note_id, note_url, keyword, html):
+        """
+        归档一页 HTML；同一笔记的相同内容不会重复记录。
+        """
+        raw = html.encode("utf-8")
+        digest = hashlib.sha256(raw).hexdigest()
+        with self.lock:
+            if (note_id, digest) in self.entries:
+                return
+            location = self.locations.get(digest)
+            if location is None:
+                if self._segment_fp.tell() >= self.segment_size:
+                    self._segment_fp.close()
+                    self.segment_no += 1
+                    self._segment_fp = open(self._segment_path(self.segment_no), "ab")
+                blob = self._compress(raw)
+                location = {
+                    "segment": self.segment_no,
+                    "offset": self._segment_fp.tell(),
+                    "length": len(blob),
+                    "codec": self.codec,
+                }
+                self._segment_fp.write(blob)
+                self._segment_fp.flush()
+            entry = {
+                "note_id": note_id, "note_url": note_url, "keyword": keyword, "sha256": digest,
+                "archived_at": time.time(), "segment": location["segment"], "offset": location["offset"],
+                "length": location["length"], "codec": location["codec"],
+            }
+            self._index_fp.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._index_fp.flush()
+            self.locations[digest] = entry
+            self.entries.add((note_id, digest))
+
+    def close(self):
+        self._segment_fp.close()
+        self._index_fp.close()
+
+def iter_archived_pages(archive_dir):
+    """
+    按索引顺序逐页读出归档，产出 (索引记录, HTML)。
+    """
+    index_file = os.path.join(archive_dir, "index.jsonl")
+    return read_archived_pages((archive_dir, entry) for entry in HtmlArchive.read_index(index_file))
+
+def read_archived_pages(items):
+    """
+    按给定顺序读出 (归档目录, 索引记录) 对应的页面，产出 (索引记录, HTML)；可跨多个归档目录。
+    """
+    decompressor = zstandard.ZstdDecompressor() if zstandard else None
+    segment_fps = {}
+    try:
+        for archive_dir, entry in items:
+            segment_key = (archive_dir, entry["segment"])
+            if segment_key not in segment_fps:
+                path = os.path.join(archive_dir, "segments", f"seg-{entry['segment']:05d}.bin")
+                segment_fps[segment_key] = open(path, "rb")
+            fp = segment_fps[segment_key]
+            fp.seek(entry["offset"])
+            blob = fp.read(entry["length"])
+            if entry["codec"] == "zstd":
+                if decompressor is None:
+                    raise RuntimeError("归档使用 zstd 压缩，请先安装 zstandard。")
+                raw = decompressor.decompress(blob)
+            else:
+                raw = zlib.decompress(blob)
+            yield entry, raw.decode("utf-8")
+    finally:
+        for fp in segment_fps.values():
+            fp.close()
+
+def rebuild_from_archive(archive_dir, output_file):
+    """
+    从归档重新抽取全部笔记，写出与 notes.jsonl 相同格式的文件。
+    批量模式下各进程写在 archive_dir 的子目录中，这里一并读取，并按笔记 ID 跨目录去重：
+    同一笔记（包括在不同关键词、不同进程下抓到的）只保留最近归档的一份。
+    输出按所保留页面的归档时间排列（没有归档时间的旧索引按目录和索引顺序），不保证与 notes.jsonl 的行序相同。
+    archive_dir 未设置或其中没有归档时直接报错，不覆盖 output_file。
+    """
+    if not archive_dir:
+        raise RuntimeError("rebuild 模式需要先设置 html_archive_dir（抓取时保存的 HTML 归档目录）。")
+    archive_dirs = sorted(root for root, _, files in os.walk(archive_dir) if "index.jsonl" in files)
+    if not archive_dirs:
+        raise RuntimeError(f"归档目录 {archive_dir} 中没有找到 index.jsonl，无法重建；请检查 html_archive_dir。")
+    start_time = time.time()
+    latest = {}
+    for dir_no, d in enumerate(archive_dirs):
+        for position, entry in enumerate(HtmlArchive.read_index(os.path.join(d, "index.jsonl"))):
+            order = (entry.get("archived_at", 0.0), dir_no, position)
+            if entry["note_id"] not in latest or order > latest[entry["note_id"]][0]:
+                latest[entry["note_id"]] = (order, d, entry)
+    pages = read_archived_pages((d, entry) for _, d, entry in sorted(latest.values(), key=lambda item: item[0]))
 
-base_url = "https://www.xiaohongshu.com/search_result?keyword="
-total_expected = len(keywords) * max_notes  # 预期总抓取量（链接数）
-all_collected_links = 0
-all_detail_count = 0
+    count = 0
+    with open(output_file, "w", encoding="utf-8") as f:
+        for entry, html in pages:
+            note_data = extract_note_from_html(html, entry["note_url"])
+            record = {"keyword": entry["keyword"], **note_data}
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+    elapsed = time.time() - start_time
+    pages_per_sec = count / elapsed if elapsed > 0 else 0.0
+    print(f"已从归档重建 {count} 条笔记，耗时 {elapsed:.2f} 秒，速度 {pages_per_sec:.1f} 页/秒，"
+          f"结果已保存到 {output_file}。")
 
-with open(jsonl_output_file, "a", encoding="utf-8") as jsonl_file:
+# ========== 无人值守批量模式 ==========
+
+# 批量模式下每个进程各自持有的浏览器与编号，以及浏览器启动失败时的错误信息
+batch_driver = None
+batch_slot = 0
+batch_init_error = ""
+
+def _batch_worker_init(slot_counter):
+    """
+    批量模式的进程初始化：领取编号，复制一份登录态并启动浏览器，进程内所有关键词复用同一浏览器。
+    初始化中的异常不能抛出（Pool 会不断重启进程重试），而是记录下来，由该进程处理的每个关键词报告失败。
+    """
+    global batch_driver, batch_slot, batch_init_error
+    with slot_counter.get_lock():
+        batch_slot = slot_counter.value
+        slot_counter.value += 1
+
+    try:
+        profile_dir = ""
+        if user_data_dir:
+            profile_dir = os.path.join(worker_profile_root, f"batch{batch_slot}")
+            clone_profile(user_data_dir, profile_dir)
+        batch_driver = create_driver(profile_dir, debug_port=9300 + batch_slot)
+        multiprocessing.util.Finalize(None, batch_driver.quit, exitpriority=10)
+        batch_driver.get(site_root)
+    except Exception as e:
+        batch_init_error = f"浏览器启动失败：{e}"
+        print(f"批量进程 {batch_slot} {batch_init_error}")
+
+def _batch_part_path(keyword):
+    return os.path.join(batch_parts_dir, f"{quote(keyword, safe='')}.jsonl")
+
+def _batch_crawl_keyword(keyword):
+    """
+    在批量进程中处理一个关键词，详情写入该关键词自己的中间文件。
+    返回 (关键词, 链接数, 详情数, 错误信息)。
+    """
+    if batch_init_error:
+        return keyword, 0, 0, batch_init_error
+    index = CrawlIndex(crawl_state_dir) if crawl_state_dir else None
+    archive = None
+    if html_archive_dir:
+        # HtmlArchive 只支持单进程写入，每个进程使用各自的子目录
+        archive = HtmlArchive(os.path.join(html_archive_dir, f"batch{batch_slot}"))
+    try:
+        with open(_batch_part_path(keyword), "a", encoding="utf-8") as part_file:
+            found_count, detail_count = crawl_keyword(batch_driver, [], keyword, part_file,
+                                                      index, archive)
+        return keyword, found_count, detail_count, ""
+    except Exception as e:
+        print(f"关键词【{keyword}】处理失败：{e}")
+        return keyword, 0, 0, str(e)
+    finally:
+        if index:
+            index.close()
+        if archive:
+            archive.close()
+
+def merge_batch_parts(keywords, output_file):
+    """
+    按关键词顺序把各进程的中间文件合并追加到 output_file，按笔记 ID 去重
+    （包括 output_file 中已有的笔记），合并后删除中间文件。返回各关键词新增的笔记数。
+    """
+    seen = set()
+    if os.path.exists(output_file):
+        with open(output_file, "r", encoding="utf-8") as f:
+            for line in f:
+                seen.add(extract_note_id(json.loads(line).get("note_url", "")))
+
+    merged = {}
+    with open(output_file, "a", encoding="utf-8") as out:
+        for keyword in keywords:
+            part_path = _batch_part_path(keyword)
+            merged[keyword] = 0
+            if not os.path.exists(part_path):
+                continue
+            with open(part_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    note_id = extract_note_id(json.loads(line)["note_url"])
+                    if note_id in seen:
+                        continue
+                    seen.add(note_id)
+                    out.write(line)
+                    merged[keyword] += 1
+            os.remove(part_path)
+    return merged
+
+def run_batch():
+    """
+    无人值守批量抓取：不等待手动登录，按 batch_concurrency 个进程并发处理 keywords，
+    最后合并为一份去重后的 notes.jsonl，并输出每个关键词的预期与实际数量。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(batch_parts_dir, exist_ok=True)
+    if crawl_state_dir:
+        # 先在主进程中完成索引的初始化（必要时从 notes.jsonl 导入），避免各进程重复导入
+        CrawlIndex(crawl_state_dir, bootstrap_file=jsonl_output_file).close()
+
+    concurrency = max(1, min(batch_concurrency, len(keywords)))
+    print(f"批量模式：{len(keywords)} 个关键词，{concurrency} 个进程并发处理...\n")
+    start_time = time.time()
+    slot_counter = multiprocessing.Value("i", 0)
+    with multiprocessing.Pool(concurrency, initializer=_batch_worker_init,
+                              initargs=(slot_counter,)) as pool:
+        results = {r[0]: r for r in pool.imap_unordered(_batch_crawl_keyword, keywords)}
+        pool.close()
+        pool.join()
+
+    merged = merge_batch_parts(keywords, jsonl_output_file)
+    elapsed = time.time() - start_time
+
+    print("所有关键词处理结束。各关键词结果（预期链接 / 实际链接 / 详情 / 去重后新增）：")
+    total_links = total_details = total_merged = 0
     for keyword in keywords:
+        _, found_count, detail_count, error = results[keyword]
+        total_links += found_count
+        total_details += detail_count
+        total_merged += merged[keyword]
+        note = f"，失败：{error}" if error else ""
+        print(f"  【{keyword}】{max_notes} / {found_count} / {detail_count} / {merged[keyword]}{note}")
+    print(f"预期抓取笔记链接总数：{len(keywords) * max_notes}，实际获取笔记链接总数：{total_links}")
+    print(f"共采集到笔记详情：{total_details} 条，去重后新增 {total_merged} 条，已合并到 {jsonl_output_file}。")
+    print(f"总耗时 {elapsed:.1f} 秒。")
+
+# ========== 主流程 ==========
+
+def crawl_keyword(driver, worker_drivers, keyword, jsonl_file, index=None, archive=None):
+    """
+    处理单个关键词：滚动收集笔记链接，再抓取详情写入 JSONL 和 CSV。
+    提供 index 时跳过已抓取的笔记；若该关键词上次未完成，直接沿用检查点中的链接继续。
+    提供 archive 时同时归档每个详情页的原始 HTML。
+    返回 (收集到的链接数, 本次抓取的详情数)。
+    """
+    print(f"开始处理关键词：{keyword}")
+    checkpoint = index.load_checkpoint(keyword) if index else None
+
+    if checkpoint and not checkpoint["done"]:
+        note_links = checkpoint["links"]
+        print(f"关键词【{keyword}】上次未完成，沿用检查点中的 {len(note_links)} 条网址继续。")
+    else:
         # 第一个任务：滚动抓取笔记网址
-        print(f"开始处理关键词：{keyword}")
         encoded_keyword = quote(keyword)
-        search_url = f"{base_url}{encoded_keyword}"
-        driver.get(search_url)
-        time.sleep(3 + random.uniform(1, 3))
+        search_url = f"{site_root}/search_result?keyword={encoded_keyword}"
+        # 与详情页相同：先取令牌再发出请求，加载后再留出固定的渲染时间
+        pacer.wait("search")
+        start_time = time.time()
+        try:
+            driver.get(search_url)
+        except Exception:
+            pacer.observe("search", time.time() - start_time, ok=False)
+            raise
+        pacer.observe("search", time.time() - start_time)
+        pacer.settle("search")
 
         note_links = scroll_and_get_links(driver, max_count=max_notes)
-        found_count = len(note_links)
-        all_collected_links += found_count
-
-        # 第一个任务完成，汇报抓取结果
-        print(f"第一个任务完成：关键词【{keyword}】，共抓取 {found_count} 条网址。")
-
-        # 第二个任务：采集每个网址的笔记详情
-        csv_filename = os.path.join(output_dir, f"{keyword}.csv")
-        with open(csv_filename, "w", encoding='utf8', newline='') as fp:
-            writer = csv.writer(fp)
-            writer.writerow([
-                '笔记链接', '标题', '喜欢数', '收藏数', '评论数',
-                '时间', '笔记图片', '用户主页', '头像图片',
-                '用户昵称', '标签', '文本'
-            ])
-
-            detail_count = 0
-            for url in note_links:
-                note_data = extract_note_details(driver, url)
-                detail_count += 1
-                all_detail_count += 1
-
-                # 写入 CSV（可根据需要保留或去除）
-                writer.writerow([
-                    note_data["note_url"],
-                    note_data["title"],
-                    note_data["likes"],
-                    note_data["favorites"],
-                    note_data["comments"],
-                    note_data["time"],
-                    "|".join(note_data["images"]),
-                    note_data["user_home"],
-                    note_data["avatar_image"],
-                    note_data["user_nickname"],
-                    "|".join(note_data["tags"]),
-                    note_data["text"]
-                ])
-
-                # 实时写入 JSONL
-                record = {"keyword": keyword, **note_data}
-                jsonl_file.write(json.dumps(record, ensure_ascii=False) + "\n")
-                jsonl_file.flush()
-
-                # 每 10 条进度提示
-                if detail_count % 10 == 0:
-                    print(f"关键词【{keyword}】已抓取笔记详情 {detail_count} 条...")
-
-        print(f"关键词【{keyword}】详情采集完毕，共抓取 {detail_count} 条。\n")
-
-# 全部关键词处理完毕，输出整体结果
-print("所有关键词处理结束。")
-print(f"预期抓取笔记链接总数：{total_expected}，实际获取笔记链接总数：{all_collected_links}")
-print(f"共采集到笔记详情：{all_detail_count} 条。")
-driver.quit()
-print("程序运行结束。")
\ No newline at end of file
+        if index:
+            index.save_checkpoint(keyword, note_links)
+    found_count = len(note_links)
+
+    # 第一个任务完成，汇报抓取结果
+    print(f"第一个任务完成：关键词【{keyword}】，共抓取 {found_count} 条网址。")
+
+    # 跳过已抓取过的笔记（同一笔记的不同链接也只抓一次）
+    pending_links = note_links
+    if index:
+        pending_links = []
+        pending_ids = set()
+        for url in note_links:
+            note_id = extract_note_id(url)
+            if note_id in index or note_id in pending_ids:
+                continue
+            pending_ids.add(note_id)
+            pending_links.append(url)
+        print(f"其中 {found_count - len(pending_links)} 条已抓取过，本次需抓取 {len(pending_links)} 条。")
+
+    # 第二个任务：采集每个网址的笔记详情；续爬时追加到已有 CSV
+    csv_filename = os.path.join(output_dir, f"{keyword}.csv")
+    csv_exists = index is not None and os.path.exists(csv_filename) and os.path.getsize(csv_filename) > 0
+    with open(csv_filename, "a" if csv_exists else "w", encoding='utf8', newline='') as fp:
+        writer = csv.writer(fp)
+        if not csv_exists:
+            writer.writerow(CSV_HEADER)
+
+        keep_html = archive is not None
+        if worker_drivers:
+            notes = crawl_details_pool(worker_drivers, pending_links, keep_html)
+        else:
+            notes = crawl_details_serial(driver, pending_links, keep_html)
+
+        detail_count = 0
+        start_time = time.time()
+        for note_data, html in notes:
+            write_note(writer, jsonl_file, keyword, note_data)
+            note_id = extract_note_id(note_data["note_url"])
+            if archive and html:
+                archive.put(note_id, note_data["note_url"], keyword, html)
+            if index:
+                index.add(note_id)
+            detail_count += 1
+
+            # 每 10 条进度提示
+            if detail_count % 10 == 0:
+                print(f"关键词【{keyword}】已抓取笔记详情 {detail_count} 条...")
+        elapsed = time.time() - start_time
+
+    if index:
+        index.save_checkpoint(keyword, note_links, done=True)
+
+    pages_per_sec = detail_count / elapsed if elapsed > 0 else 0.0
+    print(f"关键词【{keyword}】详情采集完毕，共抓取 {detail_count} 条，"
+          f"耗时 {elapsed:.1f} 秒，速度 {pages_per_sec:.2f} 页/秒。")
+    print(f"访问节奏统计：{pacer.report()}\n")
+    return found_count, detail_count
+
+def main():
+    if run_mode == "offline":
+        extract_offline(offline_html_dir, offline_output_file, offline_expected_file)
+        return
+    if run_mode == "rebuild":
+        rebuild_from_archive(html_archive_dir, rebuild_output_file)
+        return
+    if run_mode == "batch":
+        run_batch()
+        return
+
+    os.makedirs(output_dir, exist_ok=True)
+    print("启动中，请等待...")
+
+    # ======== 启动浏览器 ========
+    driver = create_driver(user_data_dir)
+    print("启动完成，请手动登录小红书...")
+
+    # 打开小红书主页，用户手动登录
+    driver.get(site_root)
+    input("请在打开的浏览器窗口中手动完成登录，登录完成后按回车键继续...")
+
+    driver.refresh()
+    print("已成功完成登录，开始爬取数据...\n")
+
+    # 并发模式：登录完成后再复制登录态，启动其余浏览器
+    worker_drivers = start_worker_drivers(detail_workers) if detail_workers > 1 else []
+
+    total_expected = len(keywords) * max_notes  # 预期总抓取量（链接数）
+    all_collected_links = 0
+    all_detail_count = 0
+
+    index = CrawlIndex(crawl_state_dir, bootstrap_file=jsonl_output_file) if crawl_state_dir else None
+    archive = HtmlArchive(html_archive_dir) if html_archive_dir else None
+
+    with open(jsonl_output_file, "a", encoding="utf-8") as jsonl_file:
+        for keyword in keywords:
+            found_count, detail_count = crawl_keyword(driver, worker_drivers, keyword, jsonl_file,
+                                                      index, archive)
+            all_collected_links += found_count
+            all_detail_count += detail_count
+
+    if index:
+        index.close()
+    if archive:
+        archive.close()
+
+    # 全部关键词处理完毕，输出整体结果
+    print("所有关键词处理结束。")
+    print(f"预期抓取笔记链接总数：{total_expected}，实际获取笔记链接总数：{all_collected_links}")
+    print(f"共采集到笔记详情：{all_detail_count} 条。")
+    for d in worker_drivers:
+        d.quit()
+    driver.quit()
+    print("程序运行结束。")
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,10 @@ import json
 import re
 from datetime import datetime, timedelta
 
+import pandas as pd
+import pyarrow as pa
+import pyarrow.json as pa_json
+
 CHINA_REGIONS = [
     "北京", "天津", "上海", "重庆", "河北", "山西", "辽宁", "吉林", "黑龙江", "江苏", "浙江", "安徽", "福建", "江西", "山东", "河南", "湖北", "湖南", "广东", "海南", "四川", "贵州", "云南", "陕西", "甘肃", "青海", "台湾", "内蒙古", "广西", "西藏", "宁夏", "新疆"
 ]
@@ -52,10 +56,12 @@ def process_data(records):
         unique_records[record_id] = record
     return list(unique_records.values())
 
+KEYS_ORDER = [
+    "id", "user_nickname", "title", "text", "tags", "likes", "favorites", "comments", "time", "ip", "note_url", "images", "user_home", "avatar_image"
+]
+
 def restructure_data(records):
-    keys_order = [
-        "id", "user_nickname", "title", "text", "tags", "likes", "favorites", "comments", "time", "ip", "note_url", "images", "user_home", "avatar_image"
-    ]
+    keys_order = KEYS_ORDER
     for record in records:
         record.pop("keyword", None)
     return [{key: record[key] for key in keys_order} for record in records]
@@ -65,10 +71,116 @@ def write_jsonl(file_path, records):
         for record in records:
             file.write(json.dumps(record, ensure_ascii=False) + '\n')
 
+# ========== 列式处理：与上面逐条处理的逻辑一致，用 pandas 字符串向量运算整列处理 ==========
+
+def process_numbers_column(values):
+    """
+    整列转换点赞/收藏/评论数：占位文字记为 0，“1.2万”换算为 12000，其余直接转整数。
+    """
+    values = values.astype(str)
+    placeholder = values.isin(["点赞", "收藏", "评论"])
+    wan = values.str.contains("万", regex=False) & ~placeholder
+    plain = ~placeholder & ~wan
+
+    result = pd.Series(0, index=values.index, dtype="int64")
+    if wan.any():
+        wan_values = values[wan].str.replace("万", "", regex=False).astype("float64") * 10000
+        result[wan] = wan_values.astype("int64")
+    if plain.any():
+        result[plain] = values[plain].astype("int64")
+    return result
+
+def process_time_column(values):
+    """
+    整列解析时间，返回 (日期列, IP 列)，规则与 process_time 相同。
+    """
+    values = values.str.replace(r"^编辑于 ", "", regex=True)
+    last_token = values.str.extract(r"(?P<token>\S+)\s*$")["token"]
+    dates = values.copy()
+    ips = pd.Series("", index=values.index, dtype=object)
+
+    # 按 process_time 中的判断顺序倒序赋值，使靠前的规则优先
+    month_day = values.str.extract(r"^(?P<date>\d{2}-\d{2}) (?P<ip>.+)")
+    matched = month_day["date"].notna()
+    dates[matched] = month_day.loc[matched, "date"]
+    ips[matched] = month_day.loc[matched, "ip"]
+
+    days_ago = values.str.extract(r"^(?P<days>\d+) 天前")["days"]
+    matched = days_ago.notna()
+    if matched.any():
+        # “N 天前”的取值种类很少，只对不同的 N 计算一次日期
+        today = datetime.strptime("01-26", "%m-%d")
+        date_map = {d: (today - timedelta(days=int(d))).strftime("%m-%d")
+                    for d in days_ago[matched].unique()}
+        dates[matched] = days_ago[matched].map(date_map)
+        ips[matched] = last_token[matched]
+
+    for pattern, date in ((r"昨天 \d{2}:\d{2}", "01-25"), (r"今天 \d{2}:\d{2}", "01-26")):
+        matched = values.str.match(pattern).fillna(False).astype(bool)
+        dates[matched] = date
+        ips[matched] = last_token[matched]
+    return dates.astype(object), ips
+
+def process_chunk_columnar(df):
+    """
+    列式处理一批记录：提取 ID、转换数值与时间、过滤国内 IP，并按 KEYS_ORDER 排列字段。
+    """
+    df = df.copy()
+    df["id"] = df["note_url"].str.extract(r"/search_result/(?P<id>\w+)")["id"]
+    df = df[df["id"].notna()]
+    for column in ("likes", "favorites", "comments"):
+        df[column] = process_numbers_column(df[column])
+    df["time"], df["ip"] = process_time_column(df["time"])
+    df = df[~df["ip"].isin(CHINA_REGIONS)]
+    return df[KEYS_ORDER]
+
+def iter_jsonl_chunks(file_path, block_size=64 << 20):
+    """
+    用 pyarrow 流式读取 JSONL，逐块产出 DataFrame；数值与时间字段按字符串读取，交给后续统一转换。
+    """
+    string_fields = [pa.field(name, pa.string()) for name in ("note_url", "time", "likes", "favorites", "comments")]
+    parse_options = pa_json.ParseOptions(explicit_schema=pa.schema(string_fields),
+                                         unexpected_field_behavior="infer")
+    read_options = pa_json.ReadOptions(block_size=block_size)
+    with pa_json.open_json(file_path, read_options=read_options, parse_options=parse_options) as reader:
+        for batch in reader:
+            yield batch.to_pandas(types_mapper=pd.ArrowDtype)
+
+def process_file_columnar(file_path):
+    """
+    分块读取 JSONL 并列式处理，最后按笔记 ID 去重：
+    与 process_data 一样，保留同一 ID 最后一次出现的内容，位置取其第一次出现的位置。
+    """
+    df = pd.concat([process_chunk_columnar(chunk) for chunk in iter_jsonl_chunks(file_path)],
+                   ignore_index=True)
+    first_order = df["id"].drop_duplicates(keep="first")
+    latest = df.drop_duplicates("id", keep="last").set_index("id", drop=False)
+    return latest.loc[first_order].reset_index(drop=True)
+
+def write_jsonl_columnar(file_path, df, chunk_size=100000):
+    """
+    分块把 DataFrame 写为与 write_jsonl 格式相同的 JSONL（pyarrow 读入的列表字段为数组，写出时转回列表）。
+    """
+    with open(file_path, 'w', encoding='utf-8') as file:
+        for start in range(0, len(df), chunk_size):
+            for record in df.iloc[start:start + chunk_size].to_dict("records"):
+                file.write(json.dumps(record, ensure_ascii=False, default=list) + '\n')
+
+# 是否使用列式处理（大数据量时更快、更省内存），列式处理时额外输出 Parquet 文件
+use_columnar = True
+
 file_path = '小红书/processed_notes.jsonl'
-processed_records = process_data(read_jsonl(file_path))
-restructured_records = restructure_data(processed_records)
 output_file_path = '/Users/jhx/Documents/Code/processed_notes_data1.jsonl'
-write_jsonl(output_file_path, restructured_records)
+parquet_output_file_path = '/Users/jhx/Documents/Code/processed_notes_data1.parquet'
+
+if use_columnar:
+    processed_df = process_file_columnar(file_path)
+    write_jsonl_columnar(output_file_path, processed_df)
+    processed_df.to_parquet(parquet_output_file_path, index=False)
+    print("Parquet 文件已输出:", parquet_output_file_path)
+else:
+    processed_records = process_data(read_jsonl(file_path))
+    restructured_records = restructure_data(processed_records)
+    write_jsonl(output_file_path, restructured_records)
 
 print("数据处理完成，输出文件为:", output_file_path)
\ No newline at end of file
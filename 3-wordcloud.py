@@ -1,13 +1,23 @@
 # -*- coding: utf-8 -*-
 
 import json
+import re
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import jieba
-from sklearn.feature_extraction.text import TfidfVectorizer
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import TfidfVectorizer, TfidfTransformer
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from wordcloud import WordCloud
 from matplotlib.font_manager import FontProperties
 import os
 
+from corpus_utils import analyze_vocab, corpus_matches, load_doc_term, load_token_corpus
+
 # ========== 文件路径部分：请根据需要修改 ==========
 # 输入文件：应是分词后含 'text_processed' 字段的 JSONL 文件
 data_file = 'preprocessed_data.jsonl'
@@ -18,29 +28,129 @@ font_path = ''
 # 输出结果文件
 output_tfidf_json = 'tfidf_result.json'
 output_wordcloud_img = 'wordcloud.png'
+# 分词阶段生成的整数编码语料目录；存在时直接加载，免去解析 JSON、切分字符串和重新构建词表
+corpus_dir = 'corpus'
+# 流式 TF-IDF：True 时分块读取 JSONL，两遍扫描、稀疏按列累加，内存只与词表大小和块大小有关，适合超出内存的语料
+use_streaming_tfidf = False
+stream_chunk_size = 5000
+# 是否弹出窗口显示词云（无图形界面的服务器上设为 False，只保存图片）
+show_plot = True
 
-def main():
-    # 1. 读取 JSONL 文件
-    data = []
-    with open(data_file, 'r', encoding='utf-8') as f:
+# ========== 批量词云 ==========
+# 分组方式：None 只生成全局词云；"keyword" 按爬取关键词、"date" 按日期、"topic" 按 LDA 主题各生成一张
+batch_group_by = None
+batch_output_dir = 'wordclouds'
+# 并行渲染的进程数；每个进程只在启动时加载一次字体和词云布局设置
+batch_workers = os.cpu_count() or 1
+# 文档数少于该值的分组不生成词云
+batch_min_docs = 5
+# 按关键词分组时，从爬虫输出的 notes.jsonl 中按笔记 ID 查找所属关键词
+keyword_source_file = 'notes.jsonl'
+# 按日期分组的粒度："day" 按天，"month" 按月
+date_bucket = 'day'
+# 按主题分组时读取的 LDA 结果文件（4-LDA.py 输出的 Parquet；也兼容导出的 JSONL）
+topic_result_file = 'data_with_topics_8.parquet'
+
+def tfidf_from_corpus(vocab, counts, stopwords, max_features):
+    """
+    直接使用语料中预先构建的文档-词频稀疏矩阵，先用与 tfidf_in_memory 相同的分析器映射词表，
+    再按总词频选出 max_features 个词，计算 TF-IDF 并按列求和，结果与 TfidfVectorizer 相同。
+    """
+    analyzer = TfidfVectorizer(stop_words=stopwords, token_pattern=r"(?u)\b\w+\b",
+                               analyzer='word').build_analyzer()
+    counts, terms = analyze_vocab(vocab, counts, analyzer)
+    # 与 TfidfVectorizer 一致：按词表字母序排列后，取总词频最高的 max_features 个词
+    # （整数词频 + 默认排序算法，并列时的取舍也与 sklearn 相同）
+    candidates = np.argsort(terms.astype(str), kind='stable')
+    term_freq = np.asarray(counts.sum(axis=0)).ravel()[candidates]
+    selected = candidates[np.sort(np.argsort(-term_freq)[:max_features])]
+
+    tfidf_matrix = TfidfTransformer().fit_transform(counts[:, selected])
+    feature_names = terms[selected].tolist()
+    return feature_names, np.asarray(tfidf_matrix.sum(axis=0)).ravel()
+
+def iter_text_chunks(file_path, size):
+    """
+    逐块读取 JSONL 中的 text_processed，每块最多 size 条。
+    """
+    chunk = []
+    with open(file_path, 'r', encoding='utf-8') as f:
         for line in f:
-            data.append(json.loads(line))
+            item = json.loads(line)
+            if 'text_processed' in item:
+                chunk.append(item['text_processed'])
+                if len(chunk) >= size:
+                    yield chunk
+                    chunk = []
+    if chunk:
+        yield chunk
 
-    # 提取已分好词的字段（text_processed）
-    texts_processed = [item['text_processed'] for item in data if 'text_processed' in item]
+def count_chunk(texts, analyzer, vocab, grow):
+    """
+    把一块文本编码成文档-词频 CSR 矩阵。grow 为 True 时遇到新词追加到 vocab，否则忽略 vocab 之外的词。
+    """
+    indices = []
+    indptr = [0]
+    for text in texts:
+        for word in analyzer(text):
+            j = vocab.get(word)
+            if j is None:
+                if not grow:
+                    continue
+                j = vocab[word] = len(vocab)
+            indices.append(j)
+        indptr.append(len(indices))
+    counts = sp.csr_matrix((np.ones(len(indices), dtype=np.int64), indices, indptr), shape=(len(texts), len(vocab)))
+    counts.sum_duplicates()
+    return counts
 
-    # 2. 加载停用词（可选）
-    stopwords = []
-    if stopword_path:
-        try:
-            with open(stopword_path, 'r', encoding='utf-8') as f:
-                stopwords = f.read().splitlines()
-        except:
-            print("停用词文件读取失败。")
+def streaming_tfidf(file_path, stopwords, max_features, chunk_size):
+    """
+    与 TfidfVectorizer(max_features=...) 拟合后按列求和结果相同的流式计算，分两遍扫描文件：
+    1. 逐块统计每个词的总词频和文档频率，选出总词频最高的 max_features 个词；
+    2. 逐块计算这些词的 TF-IDF（平滑 idf、行 L2 归一化），按列累加。
+    内存占用只与词表大小和块大小有关，与文档总数无关。
+    """
+    analyzer = TfidfVectorizer(stop_words=stopwords, token_pattern=r"(?u)\b\w+\b",
+                               analyzer='word').build_analyzer()
 
-    # 3. TF-IDF 词频统计
-    # 调整 max_features 以控制选取多少高频词
-    max_features = 100
+    # 第一遍：词频与文档频率
+    vocab = {}
+    term_freq = np.zeros(0, dtype=np.int64)
+    doc_freq = np.zeros(0, dtype=np.int64)
+    n_docs = 0
+    for texts in iter_text_chunks(file_path, chunk_size):
+        counts = count_chunk(texts, analyzer, vocab, grow=True)
+        term_freq = np.pad(term_freq, (0, len(vocab) - len(term_freq)))
+        doc_freq = np.pad(doc_freq, (0, len(vocab) - len(doc_freq)))
+        term_freq += np.asarray(counts.sum(axis=0)).ravel()
+        doc_freq += np.bincount(counts.indices, minlength=len(vocab))
+        n_docs += counts.shape[0]
+    print(f"第一遍扫描完成：{n_docs} 篇文档，词表大小 {len(vocab)}。")
+
+    # 与 TfidfVectorizer 一致：按字母序排列后取总词频最高的 max_features 个词
+    # （整数词频 + 默认排序算法，并列时的取舍也与 sklearn 相同）
+    words = sorted(vocab)
+    ids = np.array([vocab[w] for w in words], dtype=np.int64)
+    top = np.sort(np.argsort(-term_freq[ids])[:max_features])
+    feature_names = [words[k] for k in top]
+    selected_vocab = {w: k for k, w in enumerate(feature_names)}
+    idf = np.log((1 + n_docs) / (1 + doc_freq[ids[top]])) + 1
+    del vocab, term_freq, doc_freq
+
+    # 第二遍：TF-IDF 按列累加
+    scores = np.zeros(len(feature_names))
+    for texts in iter_text_chunks(file_path, chunk_size):
+        tfidf = count_chunk(texts, analyzer, selected_vocab, grow=False) @ sp.diags(idf)
+        norms = np.sqrt(np.asarray(tfidf.multiply(tfidf).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        scores += np.asarray((sp.diags(1.0 / norms) @ tfidf).sum(axis=0)).ravel()
+    return feature_names, scores
+
+def tfidf_in_memory(texts_processed, stopwords, max_features):
+    """
+    用 TfidfVectorizer 计算 TF-IDF，返回 (特征词, 按列求和的得分)。
+    """
     vectorizer = TfidfVectorizer(
         stop_words=stopwords,
         max_features=max_features,
@@ -50,19 +160,198 @@ def main():
     tfidf_matrix = vectorizer.fit_transform(texts_processed)
 
     feature_names = vectorizer.get_feature_names_out()
-    tfidf_scores = tfidf_matrix.toarray().sum(axis=0)
+    # 稀疏矩阵直接按列求和，不必先转成稠密数组
+    return feature_names, np.asarray(tfidf_matrix.sum(axis=0)).ravel()
 
-    # 生成词频统计结果
+def rank_scores(feature_names, tfidf_scores):
+    """
+    按得分从高到低排列，返回 [{"word": ..., "score": ...}, ...]。
+    """
     tfidf_dict = dict(zip(feature_names, tfidf_scores))
     sorted_tfidf = sorted(tfidf_dict.items(), key=lambda x: x[1], reverse=True)
-    result_list = [{"word": w, "score": s} for w, s in sorted_tfidf]
+    return [{"word": w, "score": s} for w, s in sorted_tfidf]
+
+def read_stopwords():
+    stopwords = []
+    if stopword_path:
+        try:
+            with open(stopword_path, 'r', encoding='utf-8') as f:
+                stopwords = f.read().splitlines()
+        except:
+            print("停用词文件读取失败。")
+    return stopwords
+
+def load_note_keywords(file_path):
+    """
+    从爬虫输出的 notes.jsonl 建立 {笔记 ID: [关键词, ...]}；同一笔记可能出现在多个关键词下。
+    """
+    note_keywords = defaultdict(list)
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            item = json.loads(line)
+            match = re.search(r'/(?:search_result|explore)/(\w+)', item.get('note_url', ''))
+            keyword = item.get('keyword')
+            if match and keyword and keyword not in note_keywords[match.group(1)]:
+                note_keywords[match.group(1)].append(keyword)
+    return note_keywords
+
+def date_group(time_value):
+    """
+    预处理后的 time 字段形如 "01-26" 或 "2024-12-01"；按月分组时去掉最后的日。
+    """
+    if not time_value:
+        return None
+    return time_value.rsplit('-', 1)[0] if date_bucket == 'month' else time_value
+
+def load_group_texts(group_by):
+    """
+    按 group_by 把分词结果分组，返回 {分组名: [text_processed, ...]}。
+    """
+    groups = defaultdict(list)
+    if group_by == 'topic' and topic_result_file.endswith('.jsonl'):
+        with open(topic_result_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                item = json.loads(line)
+                groups[f"topic{item['max_topic']}"].append(item['text_processed'])
+        return groups
+
+    note_keywords = load_note_keywords(keyword_source_file) if group_by == 'keyword' else None
+    if group_by == 'topic':
+        # Parquet 中只有 id、doc_index 和主题分布，按 id（没有 id 时按 LDA 输入中非空文档的序号）对回分词结果
+        topics = pd.read_parquet(topic_result_file, columns=['id', 'doc_index', 'max_topic'])
+        topic_by_id = dict(zip(topics['id'], topics['max_topic'])) if topics['id'].notna().all() else None
+        topic_by_index = topics.set_index('doc_index')['max_topic']
+    doc_index = 0
+    with open(data_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            item = json.loads(line)
+            if 'text_processed' not in item:
+                continue
+            if group_by == 'topic':
+                if not item['text_processed']:
+                    continue
+                if topic_by_id is not None:
+                    topic = topic_by_id.get(item.get('id'))
+                else:
+                    topic = topic_by_index.get(doc_index)
+                doc_index += 1
+                names = [f"topic{topic}"] if topic is not None else []
+            elif group_by == 'keyword':
+                names = [item['keyword']] if item.get('keyword') else note_keywords.get(item.get('id'), [])
+            elif group_by == 'date':
+                names = [date_group(item.get('time'))]
+            else:
+                raise ValueError(f"未知的分组方式：{group_by}")
+            for name in names:
+                if name:
+                    groups[name].append(item['text_processed'])
+    return groups
+
+# 每个渲染进程各自持有的词云对象、标题字体和停用词，在进程初始化时创建一次
+_render_state = {}
+
+def _init_render_worker(font, stopwords, out_dir):
+    _render_state['wordcloud'] = WordCloud(
+        font_path=font,
+        width=800,
+        height=400,
+        background_color='white'
+    )
+    _render_state['font_prop'] = FontProperties(fname=font)
+    _render_state['stopwords'] = stopwords
+    _render_state['out_dir'] = out_dir
+
+def _render_group(task):
+    """
+    渲染一个分组的词云：组内计算 TF-IDF，保存得分 JSON 和词云图片。
+    使用 matplotlib 的 Figure 对象直接输出到文件，不经过 pyplot，无需图形界面。
+    """
+    name, texts = task
+    try:
+        feature_names, tfidf_scores = tfidf_in_memory(texts, _render_state['stopwords'], 100)
+    except ValueError:
+        # 组内没有可用的词（文本为空、只有表情符号或全是停用词），TfidfVectorizer 报 empty vocabulary，跳过该组
+        return name, None
+    result_list = rank_scores(feature_names, tfidf_scores)
+    if not result_list:
+        return name, None
+
+    file_stem = os.path.join(_render_state['out_dir'], re.sub(r'[\\/:*?"<>|\s]+', '_', str(name)))
+    with open(f"{file_stem}.json", 'w', encoding='utf-8') as f:
+        json.dump(result_list, f, ensure_ascii=False, indent=4)
+
+    wordcloud = _render_state['wordcloud']
+    wordcloud.generate_from_frequencies({item['word']: item['score'] for item in result_list})
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots()
+    ax.imshow(wordcloud, interpolation='bilinear')
+    ax.axis('off')
+    ax.set_title(f"{name}（{len(texts)} 篇）", fontproperties=_render_state['font_prop'])
+    fig.savefig(f"{file_stem}.png")
+    return name, f"{file_stem}.png"
+
+def run_batch_wordclouds(group_by, stopwords):
+    """
+    批量模式：按关键词 / 日期 / 主题分组，多进程并行为每个分组生成一张词云。
+    """
+    groups = load_group_texts(group_by)
+    # 文档多的分组先提交，避免最后只剩一个大分组在渲染
+    tasks = sorted(((name, texts) for name, texts in groups.items() if len(texts) >= batch_min_docs),
+                   key=lambda task: len(task[1]), reverse=True)
+    print(f"按 {group_by} 分组共 {len(groups)} 组，其中 {len(tasks)} 组文档数不少于 {batch_min_docs}，"
+          f"使用 {batch_workers} 个进程渲染...")
+    os.makedirs(batch_output_dir, exist_ok=True)
+
+    start_time = time.time()
+    rendered = 0
+    with ProcessPoolExecutor(max_workers=batch_workers, initializer=_init_render_worker,
+                             initargs=(font_path, stopwords, batch_output_dir)) as executor:
+        for name, image_path in executor.map(_render_group, tasks):
+            if image_path:
+                rendered += 1
+            else:
+                print(f"分组 {name} 没有可用的词，已跳过。")
+    elapsed = time.time() - start_time
+    print(f"批量词云完成：{rendered} 张，耗时 {elapsed:.1f} 秒，保存在 '{batch_output_dir}'。")
+
+def main():
+    # 1. 加载停用词（可选）
+    stopwords = read_stopwords()
+
+    if batch_group_by:
+        run_batch_wordclouds(batch_group_by, stopwords)
+        return
+
+    # 2. TF-IDF 词频统计
+    # 调整 max_features 以控制选取多少高频词
+    max_features = 100
+    # 流式计算优先：语料的文档-词频矩阵需要整体载入内存，内存受限时不能使用
+    if use_streaming_tfidf:
+        print(f"流式计算 TF-IDF（每块 {stream_chunk_size} 条）...")
+        feature_names, tfidf_scores = streaming_tfidf(data_file, stopwords, max_features, stream_chunk_size)
+    elif corpus_dir and corpus_matches(corpus_dir, data_file):
+        print(f"从整数编码语料 {corpus_dir} 计算 TF-IDF...")
+        vocab = load_token_corpus(corpus_dir)[0]
+        counts = load_doc_term(corpus_dir)
+        feature_names, tfidf_scores = tfidf_from_corpus(vocab, counts, stopwords, max_features)
+    else:
+        # 读取 JSONL 文件，提取已分好词的字段（text_processed）
+        data = []
+        with open(data_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                data.append(json.loads(line))
+        texts_processed = [item['text_processed'] for item in data if 'text_processed' in item]
+        feature_names, tfidf_scores = tfidf_in_memory(texts_processed, stopwords, max_features)
+
+    # 生成词频统计结果
+    result_list = rank_scores(feature_names, tfidf_scores)
 
-    # 4. 保存 TF-IDF 结果为 JSON
+    # 3. 保存 TF-IDF 结果为 JSON
     with open(output_tfidf_json, 'w', encoding='utf-8') as f:
         json.dump(result_list, f, ensure_ascii=False, indent=4)
     print(f"TF-IDF 结果已保存至 '{output_tfidf_json}'。")
 
-    # 5. 读取保存的 JSON 生成词云
+    # 4. 读取保存的 JSON 生成词云
     word_freq = {item['word']: item['score'] for item in result_list}
 
     wordcloud = WordCloud(
@@ -85,7 +374,8 @@ def main():
     plt.title("词云图", fontproperties=FontProperties(fname=font_path))
 
     plt.savefig(output_wordcloud_img)
-    plt.show()
+    if show_plot:
+        plt.show()
 
     print(f"词云图已保存至 '{output_wordcloud_img}'。")
 
@@ -2,20 +2,525 @@ import os
 import pandas as pd
 import re
 import json
+import time
+import hashlib
+import pickle
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from sklearn.feature_extraction.text import CountVectorizer
 from sklearn.decomposition import LatentDirichletAllocation
 from gensim.models.coherencemodel import CoherenceModel
 from gensim.corpora.dictionary import Dictionary
 import numpy as np
+import scipy.sparse as sp
 import matplotlib.pyplot as plt
-import pyLDAvis
 from tqdm import tqdm
 from matplotlib import font_manager
 
+from corpus_utils import analyze_vocab, corpus_matches, load_doc_term, load_token_corpus
+
 # 设置文件路径
 preprocessed_file = ''  # 预处理后的数据文件路径
+# 分词阶段生成的整数编码语料目录；存在时直接由词 ID 构建词频矩阵和一致性所需的文本，不再重新切分、构建词表
+corpus_dir = 'corpus'
+# 并行扫描主题数的进程数（1 表示在当前进程中依次计算）；各进程共享同一份只读的词频矩阵
+sweep_workers = os.cpu_count() or 1
+# 每个主题数的耗时表
+timing_file = 'lda_sweep_timing.csv'
+# 一致性计算方式："index" 预先统计一次滑动窗口共现、所有主题数共用（结果与 gensim 的 c_v 相同）；
+# "gensim" 每个主题数重新构建 CoherenceModel；"check" 两者都算并输出差值，用于核对
+coherence_engine = 'index'
+
+# 运行模式："sweep" 扫描主题数（每次从头训练）；"search" 按一致性由粗到细搜索主题数；
+# "incremental" 在保存的模型上只用新增笔记在线更新；
+# "infer" 不更新模型，只推断新增笔记的主题分布；"render_vis" 为 render_vis_topics 中的主题数生成 pyLDAvis 页面
+run_mode = 'sweep'
+
+# search 模式：先在 [search_min_topics, search_max_topics] 上均匀取约 search_coarse_points 个主题数，
+# 之后每轮在一致性最高的主题数两侧以减半的步长继续试探，直到步长为 1；
+# 训练时每 search_evaluate_every 轮迭代计算一次困惑度，变化小于 search_perp_tol 即提前停止
+search_min_topics = 4
+search_max_topics = 60
+search_coarse_points = 8
+search_evaluate_every = 5
+search_perp_tol = 0.1
+# 每次试探的主题数、轮次、困惑度、一致性、迭代次数和耗时
+search_log_file = 'lda_search_log.csv'
+
+# 扫描时只保存可视化所需的矩阵（每个主题数一个 npz），需要查看时再用 render_vis 模式生成 HTML；
+# 输入未变化时直接复用已生成的页面
+vis_inputs_dir = 'lda_vis_inputs'
+render_vis_topics = [4]
+# 增量模型的主题数、保存目录（词表、模型、已学习的笔记 ID）和在线学习的小批量大小
+incremental_topics = 4
+model_dir = 'lda_model'
+incremental_batch_size = 128
+incremental_result_file = 'data_with_topics_incremental.jsonl'
+inferred_result_file = 'data_with_topics_inferred.jsonl'
+
+# 主题分布默认保存为列式的 data_with_topics_{k}.parquet（id、文档序号、max_topic、topic1..topicK）；
+# 需要与旧格式兼容的 JSONL 时设为 True，会在 Parquet 之外再批量导出一份
+export_topics_jsonl = False
+
+def count_matrix_from_corpus(vocab, token_ids, offsets, counts, max_features, max_df, min_df):
+    """
+    在语料预先构建的文档-词频矩阵上选取特征词，规则与 CountVectorizer(strip_accents='unicode') 相同：
+    先用它的分析器映射词表，再按文档频率过滤（max_df 为比例，min_df 为篇数），再取总词频最高的 max_features 个词，按字母序排列。
+    空文档会被丢弃（与读取 JSONL 时跳过空 text_processed 一致）。
+    返回 (词频矩阵, 特征词数组, 分词后的文本列表)。
+    """
+    lengths = np.diff(offsets)
+    analyzer = CountVectorizer(strip_accents='unicode').build_analyzer()
+    counts, terms = analyze_vocab(vocab, counts[lengths > 0], analyzer)
+
+    doc_freq = np.bincount(counts.indices, minlength=len(terms))
+    term_freq = np.asarray(counts.sum(axis=0)).ravel()
+    keep = np.flatnonzero((doc_freq <= max_df * counts.shape[0]) & (doc_freq >= min_df))
+    # 先按字母序排列，再用默认排序算法取词频最高的词，并列时的取舍与 CountVectorizer 相同
+    keep = keep[np.argsort(terms[keep].astype(str), kind='stable')]
+    keep = keep[np.sort(np.argsort(-term_freq[keep])[:max_features])]
+
+    vocab_arr = np.array(vocab, dtype=object)
+    texts = [vocab_arr[token_ids[offsets[i]:offsets[i + 1]]].tolist()
+             for i in np.flatnonzero(lengths > 0)]
+    return counts[:, keep], terms[keep], texts
+
+def window_presence(word_ids, window_size):
+    """
+    计算一篇长文档（长度不小于 window_size）每个滑动窗口中被计为出现的特征词，返回 (窗口序号, 特征词 ID)。
+    word_ids 中非特征词为 -1。
+
+    与 gensim WordOccurrenceAccumulator 的逐步滑动完全一致：窗口右移一格时，先把移出窗口的词标记为不存在，
+    再把新进入的词标记为存在；因此某个词若在窗口内还有其他出现位置，也可能在移出一次后被计为不存在。
+    把每次出现看作一个“加入”事件（时间 max(p - w + 1, 0)）和一个“移除”事件（时间 p + 1），
+    某窗口中词被计为出现，当且仅当此前最近的事件是加入（同一时间先移除后加入）。
+    """
+    n_windows = len(word_ids) - window_size + 1
+    positions = np.flatnonzero(word_ids >= 0)
+    if not len(positions):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    unique_ids, local = np.unique(word_ids[positions], return_inverse=True)
+
+    last_add = np.full((n_windows, len(unique_ids)), -1, dtype=np.int64)
+    add_time = np.maximum(positions - window_size + 1, 0)
+    last_add[add_time, local] = add_time
+    last_remove = np.full((n_windows, len(unique_ids)), -1, dtype=np.int64)
+    removable = positions + 1 < n_windows
+    last_remove[positions[removable] + 1, local[removable]] = positions[removable] + 1
+    np.maximum.accumulate(last_add, axis=0, out=last_add)
+    np.maximum.accumulate(last_remove, axis=0, out=last_remove)
+
+    windows, cols = np.nonzero((last_add >= 0) & (last_add >= last_remove))
+    return windows, unique_ids[cols]
+
+class CoherenceIndex:
+    """
+    c_v 一致性的共享共现索引：对全部特征词只扫描一次文本，统计每个词出现的滑动窗口数和每对词共同出现的窗口数，
+    之后任意主题词列表的一致性都直接由这些计数算出，不再重新扫描文本。
+
+    计算规则与 gensim CoherenceModel(coherence='c_v') 相同：窗口大小 110，短于窗口的文档算作一个窗口，
+    窗口总数包括所有文档；NPMI（epsilon = 1e-12）、one-set 分段、上下文向量余弦相似度，最后取算术平均。
+    """
+
+    EPSILON = 1e-12
+
+    def __init__(self, texts, words, window_size=110, chunk_windows=200000):
+        self.word_index = {w: i for i, w in enumerate(words)}
+        n_words = len(self.word_index)
+        self.num_windows = 0
+        self.co_occurrences = np.zeros((n_words, n_words), dtype=np.int64)
+
+        # 窗口-词 0/1 矩阵按块累积，每块用 W.T @ W 一次得到词对共现窗口数（对角线即单词出现的窗口数）
+        rows, cols, n_rows = [], [], 0
+        for text in texts:
+            word_ids = np.fromiter((self.word_index.get(w, -1) for w in text), dtype=np.int64, count=len(text))
+            if len(word_ids) < window_size:
+                present = np.unique(word_ids[word_ids >= 0])
+                rows.append(np.full(len(present), n_rows, dtype=np.int64))
+                cols.append(present)
+                n_rows += 1
+            else:
+                windows, present = window_presence(word_ids, window_size)
+                rows.append(windows + n_rows)
+                cols.append(present)
+                n_rows += len(word_ids) - window_size + 1
+            if n_rows >= chunk_windows:
+                self._add_windows(rows, cols, n_rows)
+                rows, cols, n_rows = [], [], 0
+        self._add_windows(rows, cols, n_rows)
+
+    def _add_windows(self, rows, cols, n_rows):
+        self.num_windows += n_rows
+        if not rows:
+            return
+        rows = np.concatenate(rows)
+        window_matrix = sp.csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, np.concatenate(cols))),
+                                      shape=(n_rows, self.co_occurrences.shape[0]))
+        self.co_occurrences += (window_matrix.T @ window_matrix).toarray()
+
+    def topic_coherence(self, topic_words):
+        """
+        单个主题的 c_v 一致性；不在文本中出现的词被忽略（与 gensim 按词典过滤一致）。
+        """
+        ids = np.array([self.word_index[w] for w in topic_words if w in self.word_index], dtype=np.int64)
+        ids = ids[self.co_occurrences[ids, ids] > 0]
+        co_prob = self.co_occurrences[np.ix_(ids, ids)] / float(self.num_windows)
+        word_prob = np.diag(co_prob)
+        npmi = (np.log((co_prob + self.EPSILON) / np.outer(word_prob, word_prob))
+                / -np.log(co_prob + self.EPSILON))
+        # one-set 分段：每个词的上下文向量与整个主题词集合的上下文向量（各行之和）求余弦相似度
+        topic_vector = npmi.sum(axis=0)
+        sims = npmi @ topic_vector / (np.linalg.norm(npmi, axis=1) * np.linalg.norm(topic_vector))
+        return float(np.mean(sims))
+
+    def coherence(self, topics):
+        return float(np.mean([self.topic_coherence(topic_words) for topic_words in topics]))
+
+def save_topic_distribution(data, doc_topic_distr, file_stem):
+    """
+    把主题分布按列保存为 Parquet：id、doc_index（在 data 中的行号）、max_topic（整列 argmax）和 topic1..topicK，
+    不向共享的 data 添加列。export_topics_jsonl 为 True 时另外批量导出旧格式的 JSONL。返回写出的文件列表。
+    """
+    n_topics = doc_topic_distr.shape[1]
+    topic_columns = [f'topic{i+1}' for i in range(n_topics)]
+    max_topic = doc_topic_distr.argmax(axis=1) + 1
+
+    result = pd.DataFrame(doc_topic_distr, columns=topic_columns)
+    result.insert(0, 'max_topic', max_topic)
+    result.insert(0, 'doc_index', np.arange(len(result)))
+    result.insert(0, 'id', data['id'].to_numpy() if 'id' in data else None)
+    result_files = [f'{file_stem}.parquet']
+    result.to_parquet(result_files[0], index=False)
+
+    if export_topics_jsonl:
+        result_files.append(f'{file_stem}.jsonl')
+        with open(result_files[1], 'w', encoding='utf-8') as f_out:
+            f_out.writelines(
+                json.dumps({
+                    'text': text,
+                    'text_processed': text_processed,
+                    'max_topic': topic,
+                    'topic_distribution': dict(zip(topic_columns, distr))
+                }, ensure_ascii=False) + '\n'
+                for text, text_processed, topic, distr in zip(
+                    data['text'], data['text_processed'], max_topic.tolist(), doc_topic_distr.tolist()))
+    return result_files
+
+# 扫描主题数时各进程共享的只读数据（词频矩阵、特征词、一致性所需的文本/词典或共现索引、原始数据），
+# 由 init_sweep_state 设置一次
+_sweep_state = {}
+
+def init_sweep_state(tf, tf_feature_names, texts, dictionary, coherence_index, data, fit_params=None):
+    _sweep_state.update(tf=tf, tf_feature_names=tf_feature_names, texts=texts, dictionary=dictionary,
+                        coherence_index=coherence_index, data=data, fit_params=fit_params or {})
+
+def vis_inputs_file(n_topics):
+    return os.path.join(vis_inputs_dir, f'lda_vis_{n_topics}.npz')
+
+def save_vis_inputs(n_topics, topic_term_dists, doc_topic_dists, doc_lengths, vocab, term_frequency):
+    """
+    保存 pyLDAvis.prepare 所需的全部输入，供 render_vis 按需生成页面。
+    """
+    os.makedirs(vis_inputs_dir, exist_ok=True)
+    np.savez(vis_inputs_file(n_topics), topic_term_dists=topic_term_dists, doc_topic_dists=doc_topic_dists,
+             doc_lengths=doc_lengths, vocab=np.asarray(vocab, dtype=str), term_frequency=term_frequency)
+
+def render_vis(n_topics):
+    """
+    由保存的输入生成主题数为 n_topics 的 pyLDAvis 页面；页面比输入新时视为缓存命中，直接返回。
+    """
+    import pyLDAvis
+
+    inputs_file = vis_inputs_file(n_topics)
+    vis_file = f'lda_visualization_{n_topics}.html'
+    if not os.path.exists(inputs_file):
+        print(f"未找到主题数为 {n_topics} 的可视化输入 '{inputs_file}'，请先运行主题数扫描。")
+        return None
+    if os.path.exists(vis_file) and os.path.getmtime(vis_file) >= os.path.getmtime(inputs_file):
+        print(f"主题数为 {n_topics} 的可视化页面已是最新：'{vis_file}'。")
+        return vis_file
+
+    start_time = time.perf_counter()
+    inputs = np.load(inputs_file)
+    vis_data = pyLDAvis.prepare(inputs['topic_term_dists'], inputs['doc_topic_dists'], inputs['doc_lengths'],
+                                inputs['vocab'].tolist(), inputs['term_frequency'])
+    pyLDAvis.save_html(vis_data, vis_file)
+    print(f"主题数为 {n_topics} 的可视化结果已保存为 '{vis_file}' 文件，耗时 {time.perf_counter() - start_time:.1f} 秒。")
+    return vis_file
+
+def fit_topic_count(n_topics):
+    """
+    针对一个主题数：训练 LDA、计算困惑度与一致性、生成可视化文件并保存结果，
+    返回困惑度、一致性和各步骤耗时。
+    """
+    tf = _sweep_state['tf']
+    tf_feature_names = _sweep_state['tf_feature_names']
+    texts = _sweep_state['texts']
+    dictionary = _sweep_state['dictionary']
+    coherence_index = _sweep_state['coherence_index']
+    data = _sweep_state['data']
+    timing = {'n_topics': n_topics}
+    start_time = time.perf_counter()
+
+    lda = LatentDirichletAllocation(n_components=n_topics, max_iter=50,
+                                    learning_method='batch',
+                                    learning_offset=50, random_state=0,
+                                    **_sweep_state['fit_params'])
+    lda.fit(tf)
+    perplexity = lda.perplexity(tf)
+    timing['n_iter'] = lda.n_iter_
+    timing['fit_seconds'] = time.perf_counter() - start_time
+
+    # 获取主题词
+    n_top_words = 20
+    topics = []
+    for topic_idx, topic in enumerate(lda.components_):
+        topic_words = [tf_feature_names[i] for i in topic.argsort()[:-n_top_words -1:-1]]
+        topics.append(topic_words)
+
+    # 计算一致性
+    step_time = time.perf_counter()
+    if coherence_index is not None:
+        coherence = coherence_index.coherence(topics)
+    if dictionary is not None:
+        cm = CoherenceModel(topics=topics, texts=texts, dictionary=dictionary, coherence='c_v', processes=1)
+        if coherence_index is not None:
+            index_coherence = coherence
+            coherence = cm.get_coherence()
+            print(f"主题数 {n_topics} 一致性核对：共现索引 {index_coherence:.6f}，gensim {coherence:.6f}，"
+                  f"差值 {abs(index_coherence - coherence):.2e}")
+        else:
+            coherence = cm.get_coherence()
+    timing['coherence_seconds'] = time.perf_counter() - step_time
+
+    # 显示进度信息
+    print(f"主题数：{n_topics}, 困惑度：{perplexity:.4f}, 一致性：{coherence:.4f}")
+
+
+    # 8. 保存每个主题数量对应的可视化输入（页面由 render_vis 模式按需生成）
+    step_time = time.perf_counter()
+    doc_topic_distr = lda.transform(tf)
+    doc_lengths = np.array(tf.sum(axis=1)).flatten()
+    term_frequency = np.array(tf.sum(axis=0)).flatten()
+    vocab = tf_feature_names
+    topic_term_dists = lda.components_ / lda.components_.sum(axis=1)[:, np.newaxis]
+    doc_topic_dists = doc_topic_distr
+
+    save_vis_inputs(n_topics, topic_term_dists, doc_topic_dists, doc_lengths, vocab, term_frequency)
+    timing['vis_seconds'] = time.perf_counter() - step_time
+
+    # 9. 保存每个主题数量对应的结果文件
+    step_time = time.perf_counter()
+    print(f"正在保存主题数为 {n_topics} 的结果文件...")
+    result_files = save_topic_distribution(data, doc_topic_distr, f'data_with_topics_{n_topics}')
+    print(f"主题数为 {n_topics} 的结果已保存为 {'、'.join(repr(f) for f in result_files)} 文件。")
+
+
+    # 10. 保存主题词到 CSV 文件
+    topics_df = pd.DataFrame()
+    for idx, topic_words in enumerate(topics):
+        topics_df[f'topic{idx+1}_word'] = topic_words
+
+    topics_file = f'lda_topics_{n_topics}.csv'
+    topics_df.to_csv(topics_file, index=False, encoding='utf-8-sig')
+    print(f"主题数为 {n_topics} 的主题词已保存为 '{topics_file}' 文件。")
+    timing['output_seconds'] = time.perf_counter() - step_time
+    timing['total_seconds'] = time.perf_counter() - start_time
+
+    return perplexity, coherence, timing
+
+def sweep_topic_counts(topic_range, tf, tf_feature_names, texts, dictionary, coherence_index, data, workers,
+                       fit_params=None):
+    """
+    对 topic_range 中的每个主题数调用 fit_topic_count，返回 {主题数: (困惑度, 一致性, 耗时)}。
+    workers 大于 1 时分配到进程池并行计算：共享数据在每个进程初始化时传入一次，之后只传主题数。
+    fit_params 为额外传给 LatentDirichletAllocation 的参数（如提前停止的 evaluate_every、perp_tol）。
+    """
+    results = {}
+    if workers <= 1:
+        init_sweep_state(tf, tf_feature_names, texts, dictionary, coherence_index, data, fit_params)
+        for n_topics in tqdm(topic_range):
+            results[n_topics] = fit_topic_count(n_topics)
+        return results
+
+    print(f"使用 {workers} 个进程并行计算 {len(topic_range)} 个主题数...")
+    # 主题数越大训练越慢，先提交大的，避免最后只剩一个进程在运行
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_sweep_state,
+                             initargs=(tf, tf_feature_names, texts, dictionary, coherence_index, data,
+                                       fit_params)) as executor:
+        futures = {executor.submit(fit_topic_count, n_topics): n_topics
+                   for n_topics in sorted(topic_range, reverse=True)}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            results[futures[future]] = future.result()
+    return results
+
+def search_topic_counts(min_topics, max_topics, coarse_points, evaluate, on_round=None):
+    """
+    由粗到细搜索一致性最高的主题数。evaluate(主题数列表) 返回 {主题数: (困惑度, 一致性, 耗时)}，
+    on_round(全部试探结果) 在每轮结束后调用（用于及时写出试探记录）。
+    第一轮在整个区间上按步长均匀试探；之后每轮以当前最优主题数为中心、上一轮步长为半径，
+    用减半的步长补充试探，直到步长为 1。一致性相同时取较小的主题数。
+    返回 (最优主题数, {主题数: (困惑度, 一致性, 耗时)})，耗时中记录试探所在的轮次。
+    """
+    results = {}
+    low, high = min_topics, max_topics
+    step = max((max_topics - min_topics) // max(coarse_points - 1, 1), 1)
+    search_round = 0
+    while True:
+        search_round += 1
+        probes = sorted((set(range(low, high + 1, step)) | {high}) - set(results))
+        if probes:
+            for n_topics, (perplexity, coherence, timing) in evaluate(probes).items():
+                timing['round'] = search_round
+                results[n_topics] = (perplexity, coherence, timing)
+        if on_round is not None:
+            on_round(results)
+        best = max(sorted(results), key=lambda k: results[k][1])
+        print(f"第 {search_round} 轮（步长 {step}）试探 {probes}，当前最优主题数 {best}，"
+              f"一致性 {results[best][1]:.4f}")
+        if step == 1:
+            return best, results
+        low, high = max(min_topics, best - step), min(max_topics, best + step)
+        step = max(step // 2, 1)
+
+# ========== 增量（在线）LDA ==========
+
+def note_key(item):
+    """
+    笔记的唯一标识：优先使用预处理得到的 id，没有时用分词结果的哈希。
+    """
+    return item.get('id') or hashlib.sha1(item['text_processed'].encode('utf-8')).hexdigest()
+
+def load_incremental_state(state_dir):
+    """
+    读取保存的词表、模型和已学习的笔记 ID；模型不存在时返回 None。
+    """
+    model_file = os.path.join(state_dir, 'model.pkl')
+    if not os.path.exists(model_file):
+        return None
+    with open(os.path.join(state_dir, 'vocabulary.json'), 'r', encoding='utf-8') as f:
+        vocabulary = json.load(f)
+    with open(model_file, 'rb') as f:
+        lda = pickle.load(f)
+    with open(os.path.join(state_dir, 'seen_ids.txt'), 'r', encoding='utf-8') as f:
+        seen_ids = set(f.read().splitlines())
+    return vocabulary, lda, seen_ids
+
+def save_incremental_state(state_dir, vocabulary, lda, new_ids):
+    """
+    保存词表和模型（先写临时文件再替换），并把本次学习的笔记 ID 追加到 seen_ids.txt。
+    """
+    os.makedirs(state_dir, exist_ok=True)
+    with open(os.path.join(state_dir, 'vocabulary.json'), 'w', encoding='utf-8') as f:
+        json.dump(list(vocabulary), f, ensure_ascii=False)
+    tmp_file = os.path.join(state_dir, 'model.pkl.tmp')
+    with open(tmp_file, 'wb') as f:
+        pickle.dump(lda, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, os.path.join(state_dir, 'model.pkl'))
+    with open(os.path.join(state_dir, 'seen_ids.txt'), 'a', encoding='utf-8') as f:
+        f.writelines(f"{note_id}\n" for note_id in new_ids)
+
+def write_topic_records(file_path, records, doc_topic_distr, mode):
+    """
+    把笔记及其主题分布写成 JSONL（格式与 data_with_topics_{k}.jsonl 相同，另带 id）。
+    """
+    n_topics = doc_topic_distr.shape[1]
+    with open(file_path, mode, encoding='utf-8') as f_out:
+        for item, distr in zip(records, doc_topic_distr):
+            record = {
+                'id': note_key(item),
+                'text': item.get('text', ''),
+                'text_processed': item['text_processed'],
+                'max_topic': int(distr.argmax()) + 1,
+                'topic_distribution': {f'topic{i+1}': float(distr[i]) for i in range(n_topics)}
+            }
+            f_out.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+def save_topic_words(lda, vocabulary, topics_file, n_top_words=20):
+    topics_df = pd.DataFrame()
+    for idx, topic in enumerate(lda.components_):
+        topics_df[f'topic{idx+1}_word'] = [vocabulary[i] for i in topic.argsort()[:-n_top_words - 1:-1]]
+    topics_df.to_csv(topics_file, index=False, encoding='utf-8-sig')
+
+def run_incremental(records, update=True):
+    """
+    增量主题模型：
+    - 首次运行：在全部笔记上建立词表（规则与扫描模式相同），用在线学习训练模型并保存；
+    - 之后的运行：固定词表，只把新增笔记交给 partial_fit 更新同一个模型，主题编号保持不变；
+      update 为 False 时不更新模型，只推断新增笔记的主题分布。
+    """
+    state = load_incremental_state(model_dir)
+    if state is None:
+        print(f"未找到已保存的模型，在全部 {len(records)} 篇笔记上训练主题数为 {incremental_topics} 的在线 LDA...")
+        vectorizer = CountVectorizer(strip_accents='unicode', max_features=1000, max_df=0.5, min_df=10)
+        tf = vectorizer.fit_transform([item['text_processed'] for item in records])
+        vocabulary = vectorizer.get_feature_names_out()
+        lda = LatentDirichletAllocation(n_components=incremental_topics, max_iter=50,
+                                        learning_method='online', learning_offset=50,
+                                        batch_size=incremental_batch_size,
+                                        total_samples=len(records), random_state=0)
+        lda.fit(tf)
+        write_topic_records(incremental_result_file, records, lda.transform(tf), 'w')
+        save_incremental_state(model_dir, vocabulary, lda, dict.fromkeys(note_key(item) for item in records))
+        save_topic_words(lda, vocabulary, 'lda_topics_incremental.csv')
+        print(f"模型已保存到 '{model_dir}'，主题分布已保存为 '{incremental_result_file}'。")
+        return
+
+    vocabulary, lda, seen_ids = state
+    # 同一篇笔记在输入中重复出现时只学习一次
+    new_records = list({note_key(item): item for item in records if note_key(item) not in seen_ids}.values())
+    print(f"已学习 {len(seen_ids)} 篇笔记，本次新增 {len(new_records)} 篇。")
+    if not new_records:
+        return
+    vectorizer = CountVectorizer(strip_accents='unicode', vocabulary=vocabulary)
+    tf_new = vectorizer.transform([item['text_processed'] for item in new_records])
+
+    if not update:
+        write_topic_records(inferred_result_file, new_records, lda.transform(tf_new), 'w')
+        print(f"新增笔记的主题分布已保存为 '{inferred_result_file}'（模型未更新）。")
+        return
+
+    # total_samples 是在线学习按比例缩放单批统计量时使用的语料总量
+    lda.total_samples = len(seen_ids) + len(new_records)
+    lda.batch_size = incremental_batch_size
+    lda.partial_fit(tf_new)
+    print(f"在线更新完成，新增笔记上的困惑度：{lda.perplexity(tf_new):.4f}")
+    write_topic_records(incremental_result_file, new_records, lda.transform(tf_new), 'a')
+    save_incremental_state(model_dir, vocabulary, lda, [note_key(item) for item in new_records])
+    save_topic_words(lda, vocabulary, 'lda_topics_incremental.csv')
+    print(f"模型已更新，新增笔记的主题分布已追加到 '{incremental_result_file}'。")
+
+def run_search(tf, tf_feature_names, texts, dictionary, coherence_index, data, font_prop):
+    """
+    search 模式：由粗到细搜索主题数，训练时按困惑度收敛提前停止；每轮结束后更新试探记录表。
+    """
+    print(f"开始在 {search_min_topics}-{search_max_topics} 范围内搜索主题数...")
+    search_start = time.perf_counter()
+    fit_params = {'evaluate_every': search_evaluate_every, 'perp_tol': search_perp_tol}
+
+    def evaluate(probes):
+        return sweep_topic_counts(probes, tf, tf_feature_names, texts, dictionary, coherence_index,
+                                  data, min(sweep_workers, len(probes)), fit_params)
+
+    def write_log(results):
+        rows = [dict(results[k][2], perplexity=results[k][0], coherence=results[k][1]) for k in sorted(results)]
+        pd.DataFrame(rows).to_csv(search_log_file, index=False, encoding='utf-8-sig')
+
+    best, results = search_topic_counts(search_min_topics, search_max_topics, search_coarse_points,
+                                        evaluate, write_log)
+    x = sorted(results)
+    fit_seconds = sum(results[k][2]['total_seconds'] for k in x)
+    print(f"搜索完成：共训练 {len(x)} 个模型（区间内共 {search_max_topics - search_min_topics + 1} 个主题数），"
+          f"最优主题数 {best}，一致性 {results[best][1]:.4f}；总耗时 {time.perf_counter() - search_start:.1f} 秒"
+          f"（各模型累计 {fit_seconds:.1f} 秒），试探记录已保存为 '{search_log_file}'。")
+
+    plot_scores(x, [results[k][0] for k in x], [results[k][1] for k in x], font_prop)
 
 def main():
+    if run_mode == 'render_vis':
+        for n_topics in render_vis_topics:
+            render_vis(n_topics)
+        return
+
     # 1. 读取预处理后的数据
     data = []
     with open(preprocessed_file, 'r', encoding='utf-8') as f:
@@ -24,119 +529,89 @@ def main():
             text = item.get('text', '')
             text_processed = item.get('text_processed', '')
             if text_processed:
-                data.append({'text': text, 'text_processed': text_processed})
+                data.append({'id': item.get('id'), 'text': text, 'text_processed': text_processed})
+
+    if run_mode in ('incremental', 'infer'):
+        run_incremental(data, update=(run_mode == 'incremental'))
+        return
+
     data = pd.DataFrame(data)
 
     print("预处理后的数据加载完成。")
 
-    # 2. 特征提取
+    # 2. 特征提取，并准备文本数据和词典
     n_features = 1000  # 提取 1000 个特征词语
-    tf_vectorizer = CountVectorizer(strip_accents='unicode',
-                                    max_features=n_features,
-                                    max_df=0.5,
-                                    min_df=10)
-    tf = tf_vectorizer.fit_transform(data['text_processed'])
+    use_corpus = bool(corpus_dir) and corpus_matches(corpus_dir, preprocessed_file)
+    if use_corpus:
+        print(f"从整数编码语料 {corpus_dir} 加载词频矩阵...")
+        vocab, token_ids, offsets = load_token_corpus(corpus_dir)
+        counts = load_doc_term(corpus_dir)
+        tf, tf_feature_names, texts = count_matrix_from_corpus(vocab, token_ids, offsets, counts,
+                                                               n_features, max_df=0.5, min_df=10)
+    else:
+        tf_vectorizer = CountVectorizer(strip_accents='unicode',
+                                        max_features=n_features,
+                                        max_df=0.5,
+                                        min_df=10)
+        tf = tf_vectorizer.fit_transform(data['text_processed'])
+        tf_feature_names = tf_vectorizer.get_feature_names_out()
+        texts = data['text_processed'].apply(lambda x: x.split()).tolist()
     print("特征提取完成。")
 
-    # 3. 准备文本数据和词典
-    texts = data['text_processed'].apply(lambda x: x.split()).tolist()
-    dictionary = Dictionary(texts)
+    # 3. 构建一致性计算所需的共现索引或词典
+    coherence_index = None
+    dictionary = None
+    if coherence_engine in ('index', 'check'):
+        start_time = time.perf_counter()
+        coherence_index = CoherenceIndex(texts, tf_feature_names)
+        print(f"一致性共现索引构建完成：{coherence_index.num_windows} 个滑动窗口，"
+              f"耗时 {time.perf_counter() - start_time:.1f} 秒。")
+    if coherence_engine in ('gensim', 'check'):
+        # 语料目录中已保存同一词表的 gensim 词典，直接加载，无需再遍历文本构建
+        dictionary = (Dictionary.load_from_text(os.path.join(corpus_dir, 'dictionary.txt'))
+                      if use_corpus else Dictionary(texts))
+    else:
+        texts = None  # 使用共现索引时，各进程不再需要分词文本
 
     # 4. 自定义主题数量范围
     min_topics = 4  # 最小主题数
     max_topics = 12  # 最大主题数
     topic_range = range(min_topics, max_topics + 1)
 
-    # 5. 准备存储困惑度和一致性数据
-    plexs = []
-    coherences = []
-
-    # 6. 设置中文字体
+    # 5. 设置中文字体
     font_path = ''  # 指定的中文字体路径
     font_prop = font_manager.FontProperties(fname=font_path)
     plt.rcParams['font.family'] = font_prop.get_name()
     plt.rcParams['axes.unicode_minus'] = False  # 解决负号显示问题
 
-    # 7. 计算困惑度和一致性，并生成 LDA 模型
-    print("开始计算困惑度和一致性，并生成 LDA 模型...")
-    for n_topics in tqdm(topic_range):
-        lda = LatentDirichletAllocation(n_components=n_topics, max_iter=50,
-                                        learning_method='batch',
-                                        learning_offset=50, random_state=0)
-        lda.fit(tf)
-        perplexity = lda.perplexity(tf)
-        plexs.append(perplexity)
+    if run_mode == 'search':
+        run_search(tf, tf_feature_names, texts, dictionary, coherence_index, data, font_prop)
+        return
 
-        # 获取主题词
-        tf_feature_names = tf_vectorizer.get_feature_names_out()
-        n_top_words = 20
-        topics = []
-        for topic_idx, topic in enumerate(lda.components_):
-            topic_words = [tf_feature_names[i] for i in topic.argsort()[:-n_top_words -1:-1]]
-            topics.append(topic_words)
-
-        # 计算一致性
-        cm = CoherenceModel(topics=topics, texts=texts, dictionary=dictionary, coherence='c_v', processes=1)
-        coherence = cm.get_coherence()
-        coherences.append(coherence)
-
-        # 显示进度信息
-        print(f"主题数：{n_topics}, 困惑度：{perplexity:.4f}, 一致性：{coherence:.4f}")
-
-
-        # 8. 保存每个主题数量对应的 LDA 可视化文件
-        print(f"正在生成主题数为 {n_topics} 的可视化文件...")
-        doc_topic_distr = lda.transform(tf)
-        doc_lengths = np.array(tf.sum(axis=1)).flatten()
-        term_frequency = np.array(tf.sum(axis=0)).flatten()
-        vocab = tf_vectorizer.get_feature_names_out()
-        topic_term_dists = lda.components_ / lda.components_.sum(axis=1)[:, np.newaxis]
-        doc_topic_dists = doc_topic_distr
-
-        vis_data = pyLDAvis.prepare(topic_term_dists, doc_topic_dists, doc_lengths, vocab, term_frequency)
-        vis_file = f'lda_visualization_{n_topics}.html'
-        pyLDAvis.save_html(vis_data, vis_file)
-        print(f"主题数为 {n_topics} 的可视化结果已保存为 '{vis_file}' 文件。")
-
-        # 9. 如果需要，保存每个主题数量对应的结果文件
-        # 如果生成速度快，可以取消以下注释，保存每个主题数量对应的结果文件
-        
-        print(f"正在保存主题数为 {n_topics} 的结果文件...")
-        # 添加主题分布到 DataFrame
-        for i in range(n_topics):
-            data[f'topic{i+1}'] = doc_topic_distr[:, i]
-
-        # 获取每篇文档的主要主题
-        data['max_topic'] = doc_topic_distr.argmax(axis=1) + 1
-
-        # 保存结果到 jsonl 文件
-        result_file = f'data_with_topics_{n_topics}.jsonl'
-        with open(result_file, 'w', encoding='utf-8') as f_out:
-            for index, row in data.iterrows():
-                record = {
-                    'text': row['text'],
-                    'text_processed': row['text_processed'],
-                    'max_topic': int(row['max_topic']),
-                    'topic_distribution': {f'topic{i+1}': float(row[f'topic{i+1}']) for i in range(n_topics)}
-                }
-                f_out.write(json.dumps(record, ensure_ascii=False) + '\n')
-        print(f"主题数为 {n_topics} 的结果已保存为 '{result_file}' 文件。")
-        
-
-        # 10. 保存主题词到 CSV 文件
-        topics_df = pd.DataFrame()
-        for idx, topic_words in enumerate(topics):
-            topics_df[f'topic{idx+1}_word'] = topic_words
-
-        topics_file = f'lda_topics_{n_topics}.csv'
-        topics_df.to_csv(topics_file, index=False, encoding='utf-8-sig')
-        print(f"主题数为 {n_topics} 的主题词已保存为 '{topics_file}' 文件。")
+    # 6. 计算困惑度和一致性，并生成 LDA 模型
+    print("开始计算困惑度和一致性，并生成 LDA 模型...")
+    sweep_start = time.perf_counter()
+    workers = min(sweep_workers, len(topic_range))
+    results = sweep_topic_counts(topic_range, tf, tf_feature_names, texts, dictionary, coherence_index,
+                                 data, workers)
+    plexs = [results[n_topics][0] for n_topics in topic_range]
+    coherences = [results[n_topics][1] for n_topics in topic_range]
 
     print("所有主题数量的模型训练和结果保存已完成。")
 
-    # 11. 绘制困惑度和一致性曲线
-    x = list(topic_range)
+    # 7. 保存每个主题数的耗时表
+    timing_df = pd.DataFrame([results[n_topics][2] for n_topics in topic_range])
+    timing_df.to_csv(timing_file, index=False, encoding='utf-8-sig')
+    print(f"主题数扫描总耗时 {time.perf_counter() - sweep_start:.1f} 秒（{workers} 个进程），"
+          f"各主题数耗时已保存为 '{timing_file}'。")
+
+    # 8. 绘制困惑度和一致性曲线
+    plot_scores(list(topic_range), plexs, coherences, font_prop)
 
+def plot_scores(x, plexs, coherences, font_prop):
+    """
+    绘制困惑度和一致性随主题数变化的曲线，保存为 perplexity_coherence.png。
+    """
     plt.figure(figsize=(12, 5))
 
     plt.subplot(1, 2, 1)
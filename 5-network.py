@@ -1,16 +1,50 @@
 # -*- coding: utf-8 -*-
 
 import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import quoteattr
 import networkx as nx
+import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 from tqdm import tqdm
 
+from corpus_utils import corpus_matches, load_token_corpus
+
 # ========== 文件路径部分：请根据需要修改 ==========
 # 已经包含分词结果的 JSONL 文件（text_processed）
 data_file = 'preprocessed_data.jsonl'
 # 输出的节点表、边表
 nodes_csv = 'network_nodes.csv'
 edges_csv = 'network_edges.csv'
+# 分词阶段生成的整数编码语料目录；存在时直接按词 ID 取词，不再解析 JSON 和切分字符串
+corpus_dir = 'corpus'
+# 共现窗口大小：每个词与其后 window_size - 1 个词各计一次共现
+window_size = 2
+# 每次向量化统计的词数上限，控制临时数组占用的内存
+chunk_tokens = 2_000_000
+# 统计共现的进程数（1 表示在当前进程中统计）；大于 1 时按词数把笔记切成分片交给进程池，
+# 各进程得到局部共现矩阵后两两归并
+count_workers = 1
+# 每个进程分到的分片数，分片越多负载越均衡
+shards_per_worker = 4
+# 运行模式："build" 生成节点表和边表；"benchmark" 对 benchmark_workers 中的每个进程数统计一次，
+# 核对结果与单进程完全一致并输出耗时和加速比
+run_mode = 'build'
+benchmark_workers = [1, 2, 4, 8]
+# 边剪枝：在汇总后的共现矩阵上依次执行，全部为默认值时保留所有边
+# - min_edge_weight：丢弃共现次数低于该值的边；
+# - disparity_alpha：差异性骨干过滤（disparity filter）的显著性水平，如 0.05，None 表示不过滤；
+# - top_k_neighbors：每个节点只保留权重最高的 k 条边（边对任一端点入选即保留），0 表示不限制
+min_edge_weight = 1
+disparity_alpha = None
+top_k_neighbors = 0
+# 另存一份 Gephi 可直接打开的 GEXF 文件；留空则不生成
+gexf_file = ''
+# 流式写出节点表、边表和 GEXF 时每批的行数
+write_chunk_rows = 500_000
 
 def read_jsonl(file_path):
     data = []
@@ -20,65 +54,312 @@ def read_jsonl(file_path):
             data.append(item)
     return data
 
+def iter_jsonl_words(data):
+    """
+    逐篇产出 JSONL 记录中 text_processed 的分词列表（空文本为空列表）。
+    """
+    for entry in data:
+        yield (entry.get('text_processed') or '').split()
+
+def encode_words(words_iter):
+    """
+    把逐篇的分词列表编码成与整数编码语料相同的结构：词表列表、词 ID 数组和文档偏移。
+    """
+    vocab = {}
+    ids = []
+    offsets = [0]
+    for words in words_iter:
+        ids.extend(vocab.setdefault(w, len(vocab)) for w in words)
+        offsets.append(len(ids))
+    return list(vocab), np.asarray(ids, dtype=np.int64), np.asarray(offsets, dtype=np.int64)
+
+def co_occurrence_counts(token_ids, offsets, vocab_size, window_size=2, progress=True):
+    """
+    一次遍历统计所有文档的词对共现次数，返回 vocab_size × vocab_size 的上三角 CSR 矩阵
+    （行号不大于列号，相同的词相邻时记在对角线上）。
+
+    窗口规则与逐篇构图时相同：长度为 L 的文档中，起点 i 取 0..L-window_size，
+    词 i 与 i+1..i+window_size-1 各计一次共现；短于 window_size 的文档不产生共现。
+    按距离 d 向量化取出所有词对，再由稀疏矩阵合并重复的词对并累加次数；
+    每次最多处理约 chunk_tokens 个词，多篇文档的计数直接相加。
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    counts = sp.csr_matrix((vocab_size, vocab_size), dtype=np.int64)
+    n_docs = len(offsets) - 1
+    doc_start = 0
+    with tqdm(total=n_docs, desc="统计共现", unit="条", disable=not progress) as progress:
+        while doc_start < n_docs:
+            # 至少取一篇文档，避免单篇超长文档时无法前进
+            doc_end = max(int(np.searchsorted(offsets, offsets[doc_start] + chunk_tokens, side='right')) - 1,
+                          doc_start + 1)
+            doc_end = min(doc_end, n_docs)
+            counts = counts + _chunk_counts(token_ids, offsets[doc_start:doc_end + 1], vocab_size, window_size)
+            progress.update(doc_end - doc_start)
+            doc_start = doc_end
+    return counts
+
+def _chunk_counts(token_ids, offsets, vocab_size, window_size):
+    ids = np.asarray(token_ids[offsets[0]:offsets[-1]], dtype=np.int64)
+    lengths = np.diff(offsets)
+    # 每个位置在所属文档中的序号，以及它能否作为窗口起点（序号 <= L - window_size）
+    doc_starts = np.repeat(offsets[:-1] - offsets[0], lengths)
+    pos_in_doc = np.arange(len(ids), dtype=np.int64) - doc_starts
+    starts = np.flatnonzero(pos_in_doc <= np.repeat(lengths, lengths) - window_size)
+    rows = []
+    cols = []
+    for d in range(1, window_size):
+        a, b = ids[starts], ids[starts + d]
+        rows.append(np.minimum(a, b))
+        cols.append(np.maximum(a, b))
+    if not rows:
+        return sp.csr_matrix((vocab_size, vocab_size), dtype=np.int64)
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    counts = sp.coo_matrix((np.ones(len(rows), dtype=np.int64), (rows, cols)), shape=(vocab_size, vocab_size))
+    return counts.tocsr()
+
+# ========== 多进程分片统计 ==========
+
+_count_state = {}
+
+def init_count_state(token_ids, offsets, vocab_size, window, corpus_path=None):
+    """
+    进程初始化：整数编码语料由各进程自行以内存映射方式打开，其余情况使用传入的词 ID 数组。
+    """
+    if corpus_path:
+        _, token_ids, offsets = load_token_corpus(corpus_path)
+    _count_state.update(token_ids=token_ids, offsets=offsets, vocab_size=vocab_size, window=window)
+
+def _count_shard(doc_range):
+    doc_start, doc_end = doc_range
+    return co_occurrence_counts(_count_state['token_ids'], _count_state['offsets'][doc_start:doc_end + 1],
+                                _count_state['vocab_size'], _count_state['window'], progress=False)
+
+def _merge_pair(pair):
+    left, right = pair
+    return left + right
+
+def shard_ranges(offsets, n_shards):
+    """
+    按词数把文档切成最多 n_shards 个连续分片，返回 [(起始文档, 结束文档), ...]。
+    """
+    n_docs = len(offsets) - 1
+    bounds = np.searchsorted(offsets, np.linspace(offsets[0], offsets[-1], n_shards + 1)[1:-1])
+    bounds = np.unique(np.concatenate([[0], np.clip(bounds, 0, n_docs), [n_docs]]))
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:])]
+
+def parallel_co_occurrence_counts(token_ids, offsets, vocab_size, window_size, workers, corpus_path=None):
+    """
+    多进程版本的 co_occurrence_counts：每个分片在进程中统计出局部共现矩阵，
+    再在进程池中逐层两两相加（树形归并），直到只剩一个矩阵。整数计数的相加与顺序无关，结果与单进程完全一致。
+    corpus_path 非空时各进程直接打开语料文件，不再向进程传递词 ID 数组。
+    """
+    shards = shard_ranges(np.asarray(offsets), workers * shards_per_worker)
+    initargs = (None, None, vocab_size, window_size, corpus_path) if corpus_path else \
+        (token_ids, offsets, vocab_size, window_size)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_count_state, initargs=initargs) as executor:
+        partials = list(tqdm(executor.map(_count_shard, shards), total=len(shards), desc="统计共现", unit="片"))
+        while len(partials) > 1:
+            merged = list(executor.map(_merge_pair, zip(partials[0::2], partials[1::2])))
+            partials = merged + partials[len(merged) * 2:]
+    return partials[0] if partials else sp.csr_matrix((vocab_size, vocab_size), dtype=np.int64)
+
+def build_graph(vocab, counts):
+    """
+    由共现矩阵构建 networkx 加权无向图（只在需要图对象时调用）。
+    """
+    coo = counts.tocoo()
+    G = nx.Graph()
+    G.add_weighted_edges_from(zip((vocab[i] for i in coo.row), (vocab[j] for j in coo.col),
+                                  coo.data.tolist()))
+    return G
+
 def build_co_occurrence_network(words_list, window_size=2):
     """
     共现网络构建：
     以 window_size 窗口遍历 words_list（已经split好的分词列表），
     并在图中为每两个词添加边。
     """
-    G = nx.Graph()
-    length = len(words_list)
-    for i in range(length - window_size + 1):
-        for j in range(i+1, i+window_size):
-            if j < length:
-                w1, w2 = words_list[i], words_list[j]
-                if G.has_edge(w1, w2):
-                    G[w1][w2]['weight'] += 1
-                else:
-                    G.add_edge(w1, w2, weight=1)
-    return G
+    vocab, token_ids, offsets = encode_words([words_list])
+    return build_graph(vocab, _chunk_counts(token_ids, offsets, len(vocab), window_size))
 
-def process_data(data):
+def process_data(vocab, token_ids, offsets, workers=1, corpus_path=None):
     """
-    合并所有文本的共现网络。
+    统计所有文本的词对共现次数（输入为词表、词 ID 数组和文档偏移），返回上三角共现矩阵；
+    同一词对在多篇文档中的共现次数累加。workers 大于 1 时使用多进程分片统计。
     """
-    G_global = nx.Graph()
-    for entry in tqdm(data, desc="处理数据", unit="条"):
-        text_processed = entry.get('text_processed', '')
-        if text_processed:
-            words = text_processed.split()
-            G_local = build_co_occurrence_network(words, window_size=2)
-            G_global = nx.compose(G_global, G_local)
-    return G_global
+    if workers > 1:
+        return parallel_co_occurrence_counts(token_ids, offsets, len(vocab), window_size, workers, corpus_path)
+    return co_occurrence_counts(token_ids, offsets, len(vocab), window_size)
 
-def generate_tables(G):
+def generate_tables(vocab, counts):
     """
-    生成节点表和边表。
+    生成节点表和边表：节点为参与共现的词，边按 (Source, Target) 的词 ID 顺序排列。
     """
-    nodes = pd.DataFrame(list(G.nodes), columns=['Id'])
+    counts = counts.tocsr()
+    counts.sum_duplicates()  # 规范化（去重并排序列号），保证边的顺序与统计方式无关
+    coo = counts.tocoo()
+    vocab_arr = np.array(vocab, dtype=object)
+    node_ids = np.unique(np.concatenate([coo.row, coo.col]))
+    nodes = pd.DataFrame({'Id': vocab_arr[node_ids]})
     nodes['Label'] = nodes['Id']  # 节点标签
 
-    edges_data = []
-    for source, target, attrs in G.edges(data=True):
-        weight = attrs.get('weight', 1)
-        edges_data.append([source, target, weight])
-    edges = pd.DataFrame(edges_data, columns=['Source', 'Target', 'Weight'])
+    edges = pd.DataFrame({'Source': vocab_arr[coo.row], 'Target': vocab_arr[coo.col], 'Weight': coo.data})
 
     return nodes, edges
 
+# ========== 边剪枝与流式写出 ==========
+
+def _edge_endpoints(row, col):
+    """
+    把上三角的边展开成“端点 - 边序号 - 另一端点”的列表（自环只计一次），用于按节点统计。
+    """
+    edge_idx = np.arange(len(row))
+    off_diag = row != col
+    return (np.concatenate([row, col[off_diag]]), np.concatenate([edge_idx, edge_idx[off_diag]]),
+            np.concatenate([col, row[off_diag]]))
+
+def disparity_mask(row, col, weight, n_nodes, alpha):
+    """
+    差异性骨干过滤（Serrano 等，2009）：节点 i 的度为 k、强度为 s 时，边 (i, j) 的显著性为
+    (1 - w_ij / s) ** (k - 1)；对任一端点小于 alpha 的边予以保留。度为 1 的节点不单独判定显著。
+    """
+    nodes, edge_idx, _ = _edge_endpoints(row, col)
+    strength = np.bincount(nodes, weights=weight[edge_idx], minlength=n_nodes)
+    degree = np.bincount(nodes, minlength=n_nodes)
+    significance = (1 - weight[edge_idx] / strength[nodes]) ** (degree[nodes] - 1)
+    keep = np.zeros(len(row), dtype=bool)
+    keep[edge_idx[significance < alpha]] = True
+    return keep
+
+def top_k_mask(row, col, weight, k):
+    """
+    每个节点按权重从高到低（权重相同按邻居词 ID）取前 k 条边，边对任一端点入选即保留。
+    """
+    nodes, edge_idx, others = _edge_endpoints(row, col)
+    order = np.lexsort((others, -weight[edge_idx], nodes))
+    sorted_nodes = nodes[order]
+    group_start = np.flatnonzero(np.r_[True, sorted_nodes[1:] != sorted_nodes[:-1]])
+    rank = np.arange(len(order)) - np.repeat(group_start, np.diff(np.r_[group_start, len(order)]))
+    keep = np.zeros(len(row), dtype=bool)
+    keep[edge_idx[order[rank < k]]] = True
+    return keep
+
+def prune_edges(counts, min_weight=1, alpha=None, top_k=0):
+    """
+    对上三角共现矩阵依次执行最小权重、差异性骨干和每节点前 k 条边的剪枝，返回剪枝后的矩阵。
+    """
+    counts = counts.tocsr()
+    counts.sum_duplicates()
+    coo = counts.tocoo()
+    row, col, weight = coo.row, coo.col, coo.data
+    print(f"共现边 {len(row)} 条")
+    steps = []
+    if min_weight > 1:
+        steps.append((f"最小权重 {min_weight}", lambda r, c, w: w >= min_weight))
+    if alpha is not None:
+        steps.append((f"差异性骨干 alpha={alpha}", lambda r, c, w: disparity_mask(r, c, w, counts.shape[0], alpha)))
+    if top_k > 0:
+        steps.append((f"每节点前 {top_k} 条边", lambda r, c, w: top_k_mask(r, c, w, top_k)))
+    for name, mask_func in steps:
+        keep = mask_func(row, col, weight)
+        row, col, weight = row[keep], col[keep], weight[keep]
+        print(f"{name}：剩余 {len(row)} 条边")
+    return sp.csr_matrix((weight, (row, col)), shape=counts.shape)
+
+def write_tables(vocab, counts, nodes_path, edges_path, chunk_rows):
+    """
+    分批把节点表和边表写成 CSV（与 generate_tables 的内容相同），不必一次生成整张表。
+    """
+    counts = counts.tocsr()
+    counts.sum_duplicates()
+    coo = counts.tocoo()
+    vocab_arr = np.array(vocab, dtype=object)
+    node_ids = np.unique(np.concatenate([coo.row, coo.col]))
+    for start in range(0, max(len(node_ids), 1), chunk_rows):
+        words = vocab_arr[node_ids[start:start + chunk_rows]]
+        pd.DataFrame({'Id': words, 'Label': words}).to_csv(
+            nodes_path, mode='w' if start == 0 else 'a', header=(start == 0), index=False, encoding='utf-8')
+    for start in range(0, max(len(coo.data), 1), chunk_rows):
+        end = start + chunk_rows
+        pd.DataFrame({'Source': vocab_arr[coo.row[start:end]], 'Target': vocab_arr[coo.col[start:end]],
+                      'Weight': coo.data[start:end]}).to_csv(
+            edges_path, mode='w' if start == 0 else 'a', header=(start == 0), index=False, encoding='utf-8')
+
+def write_gexf(vocab, counts, path, chunk_rows):
+    """
+    逐行写出 GEXF 1.3 无向图：节点 ID 为词 ID、标签为词，边带 weight；不构建 networkx 图。
+    """
+    counts = counts.tocsr()
+    counts.sum_duplicates()
+    coo = counts.tocoo()
+    node_ids = np.unique(np.concatenate([coo.row, coo.col]))
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<gexf xmlns="http://gexf.net/1.3" version="1.3">\n'
+                '  <graph mode="static" defaultedgetype="undirected">\n'
+                '    <nodes>\n')
+        for start in range(0, len(node_ids), chunk_rows):
+            f.write(''.join(f'      <node id="{i}" label={quoteattr(vocab[i])}/>\n'
+                            for i in node_ids[start:start + chunk_rows].tolist()))
+        f.write('    </nodes>\n    <edges>\n')
+        for start in range(0, len(coo.data), chunk_rows):
+            end = start + chunk_rows
+            f.write(''.join(f'      <edge id="{start + k}" source="{r}" target="{c}" weight="{w}"/>\n'
+                            for k, (r, c, w) in enumerate(zip(coo.row[start:end].tolist(),
+                                                              coo.col[start:end].tolist(),
+                                                              coo.data[start:end].tolist()))))
+        f.write('    </edges>\n  </graph>\n</gexf>\n')
+
+def run_benchmark(vocab, token_ids, offsets, corpus_path=None):
+    """
+    以单进程统计结果为基准，对 benchmark_workers 中的每个进程数统计一次共现，
+    检查边表是否完全一致，并输出耗时和相对单进程的加速比。
+    """
+    start_time = time.perf_counter()
+    expected = process_data(vocab, token_ids, offsets)
+    base_seconds = time.perf_counter() - start_time
+    expected_edges = generate_tables(vocab, expected)[1]
+    print(f"单进程：{base_seconds:.3f} 秒，{expected.nnz} 条边")
+    all_match = True
+    for workers in benchmark_workers:
+        if workers <= 1:
+            continue
+        start_time = time.perf_counter()
+        counts = process_data(vocab, token_ids, offsets, workers, corpus_path)
+        seconds = time.perf_counter() - start_time
+        match = generate_tables(vocab, counts)[1].equals(expected_edges)
+        all_match = all_match and match
+        print(f"{workers} 个进程：{seconds:.3f} 秒，加速比 {base_seconds / seconds:.2f}x，"
+              f"边表{'一致' if match else '不一致'}")
+    return all_match
+
 def main():
     # 1. 读取数据
-    data = read_jsonl(data_file)
+    corpus_path = None
+    if corpus_dir and corpus_matches(corpus_dir, data_file):
+        print(f"从整数编码语料 {corpus_dir} 读取分词结果...")
+        corpus_path = corpus_dir
+        vocab, token_ids, offsets = load_token_corpus(corpus_dir)
+    else:
+        vocab, token_ids, offsets = encode_words(iter_jsonl_words(read_jsonl(data_file)))
+
+    if run_mode == 'benchmark':
+        run_benchmark(vocab, token_ids, offsets, corpus_path)
+        return
     
-    # 2. 构建全局共现网络
-    G = process_data(data)
+    # 2. 统计全局共现次数
+    counts = process_data(vocab, token_ids, offsets, count_workers, corpus_path)
     
-    # 3. 生成节点表、边表并保存
-    nodes, edges = generate_tables(G)
-    nodes.to_csv(nodes_csv, index=False, encoding='utf-8')
-    edges.to_csv(edges_csv, index=False, encoding='utf-8')
+    # 3. 剪枝
+    counts = prune_edges(counts, min_edge_weight, disparity_alpha, top_k_neighbors)
 
+    # 4. 流式写出节点表、边表（以及 GEXF）
+    write_tables(vocab, counts, nodes_csv, edges_csv, write_chunk_rows)
     print(f"节点表格已保存至 {nodes_csv}，边表格已保存至 {edges_csv}。可在 Gephi 中导入。")
+    if gexf_file:
+        write_gexf(vocab, counts, gexf_file, write_chunk_rows)
+        print(f"GEXF 文件已保存至 {gexf_file}。")
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
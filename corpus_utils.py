@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+整数编码语料的读写工具，由 2-tokenization.py 生成语料，3-wordcloud.py、4-LDA.py、5-network.py 加载。
+语料目录结构：
+- vocab.txt：词表，每行一个词，行号即词 ID（按首次出现顺序编号）；
+- token_ids.npy：所有文档的词 ID 依次拼接的 int32 数组；
+- doc_offsets.npy：int64 数组，第 i 篇文档的词 ID 为 token_ids[offsets[i]:offsets[i+1]]；
+- doc_term.npz：文档-词频 CSR 稀疏矩阵（scipy.sparse.save_npz），列号即词 ID；
+- dictionary.txt：gensim Dictionary.save_as_text 格式的词典（词 ID 相同），可用 Dictionary.load_from_text 读取；
+- meta.json：文档数、词数、词表大小，以及生成语料的分词结果文件的 sha256。
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import scipy.sparse as sp
+
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def corpus_is_current(corpus_path, source_file):
+    """
+    语料目录中的 meta.json 记录的来源哈希与 source_file 一致时返回 True。
+    """
+    meta_file = os.path.join(corpus_path, 'meta.json')
+    if not os.path.exists(meta_file) or not os.path.exists(source_file):
+        return False
+    with open(meta_file, 'r', encoding='utf-8') as f:
+        return json.load(f).get('source_sha256') == file_sha256(source_file)
+
+
+def corpus_matches(corpus_path, source_file):
+    """
+    整数编码语料存在且 meta.json 中记录的来源哈希与 source_file 一致时返回 True；
+    否则提示用 2-tokenization.py 的 "corpus" 模式重建，由调用方回退到读取 JSONL。
+    """
+    if not os.path.exists(os.path.join(corpus_path, 'meta.json')):
+        return False
+    if not corpus_is_current(corpus_path, source_file):
+        print(f"整数编码语料 {corpus_path} 不是由 {source_file} 生成的，改为读取 JSONL"
+              f"（可用 2-tokenization.py 的 \"corpus\" 模式重建）。")
+        return False
+    return True
+
+
+def write_token_corpus(texts_processed, out_dir, source_file=None):
+    """
+    把分词结果（空格连接的字符串）写成整数编码语料（目录结构见模块说明），
+    meta.json 中记录 source_file 的 sha256。
+    下游可用 np.load(..., mmap_mode='r') 零拷贝加载，无需再解析 JSON、切分字符串、构建词表或重新向量化。
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    vocab = {}
+    ids = []
+    offsets = np.zeros(len(texts_processed) + 1, dtype=np.int64)
+    for i, text in enumerate(texts_processed):
+        words = text.split()
+        ids.extend(vocab.setdefault(w, len(vocab)) for w in words)
+        offsets[i + 1] = offsets[i] + len(words)
+    token_ids = np.asarray(ids, dtype=np.int32)
+
+    with open(os.path.join(out_dir, 'vocab.txt'), 'w', encoding='utf-8') as f:
+        f.write(''.join(w + '\n' for w in vocab))
+    np.save(os.path.join(out_dir, 'token_ids.npy'), token_ids)
+    np.save(os.path.join(out_dir, 'doc_offsets.npy'), offsets)
+
+    doc_term = sp.csr_matrix((np.ones(len(token_ids), dtype=np.int64), token_ids, offsets),
+                             shape=(len(texts_processed), len(vocab)))
+    doc_term.sum_duplicates()
+    sp.save_npz(os.path.join(out_dir, 'doc_term.npz'), doc_term)
+    doc_freq = np.bincount(doc_term.indices, minlength=len(vocab))
+    with open(os.path.join(out_dir, 'dictionary.txt'), 'w', encoding='utf-8') as f:
+        f.write(f"{len(texts_processed)}\n")
+        f.writelines(f"{vocab[w]}\t{w}\t{doc_freq[vocab[w]]}\n" for w in sorted(vocab))
+
+    meta = {'num_docs': len(texts_processed), 'num_tokens': int(len(token_ids)), 'vocab_size': len(vocab),
+            'source_sha256': file_sha256(source_file) if source_file else None}
+    with open(os.path.join(out_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    print(f"整数编码语料已保存到 {out_dir}：{meta['num_docs']} 篇文档，"
+          f"{meta['num_tokens']} 个词，词表大小 {meta['vocab_size']}。")
+
+
+def load_token_corpus(corpus_path):
+    """
+    加载整数编码语料：词表列表、词 ID 数组和文档偏移（内存映射，零拷贝）。
+    """
+    with open(os.path.join(corpus_path, 'vocab.txt'), 'r', encoding='utf-8') as f:
+        vocab = f.read().split('\n')[:-1]
+    token_ids = np.load(os.path.join(corpus_path, 'token_ids.npy'), mmap_mode='r')
+    offsets = np.load(os.path.join(corpus_path, 'doc_offsets.npy'), mmap_mode='r')
+    return vocab, token_ids, offsets
+
+
+def load_doc_term(corpus_path):
+    """
+    加载语料的文档-词频 CSR 矩阵（整体读入内存）。
+    """
+    return sp.load_npz(os.path.join(corpus_path, 'doc_term.npz'))
+
+
+def analyze_vocab(vocab, counts, analyzer):
+    """
+    把语料词表中的每个词送入 sklearn 的分析器（token_pattern、小写、去重音、停用词等），
+    按分析结果合并文档-词频矩阵的列，返回 (新的词频矩阵, 新词表数组)。
+    分词结果以空格连接，分析器切出的词不会跨越两个词，因此结果与直接分析原文相同。
+    """
+    terms = {}
+    rows = []
+    cols = []
+    for i, word in enumerate(vocab):
+        for term in analyzer(word):
+            rows.append(i)
+            cols.append(terms.setdefault(term, len(terms)))
+    mapping = sp.csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, cols)), shape=(len(vocab), len(terms)))
+    return (counts @ mapping).tocsr(), np.array(list(terms), dtype=object)